@@ -0,0 +1,172 @@
+import os
+import io
+import time
+import argparse
+
+import gmpy2
+
+import helper
+import sil
+import solve
+
+# The rectangle's corner and sides are rounded out to multiples of 1/d for
+# each d here in turn until the solution is small enough for the contest;
+# None means no rounding, and 1 leaves no folds at all
+denominators = (None, 256, 64, 16, 4, 1)
+
+def _sqrt(q):
+    if gmpy2.is_square(q.numerator) and gmpy2.is_square(q.denominator):
+        return gmpy2.mpq(gmpy2.iroot(q.numerator, 2)[0], gmpy2.iroot(q.denominator, 2)[0])
+    return None
+
+# Convex hull of the points, anticlockwise, exactly
+def hull(points):
+    points = sorted(set(points))
+    if len(points) < 3:
+        return points
+
+    def half(points):
+        h = []
+        for p in points:
+            while len(h) >= 2 and helper._orient(h[-2], h[-1], p) <= 0:
+                h.pop()
+            h.append(p)
+        return h
+
+    lower = half(points)
+    upper = half(reversed(points))
+    return lower[:-1] + upper[:-1]
+
+# Rotations (cos, sin) worth trying: none, and each one lining up an edge of
+# the silhouette's convex hull of rational length with the x-axis
+def rotations(problem):
+    rs = [(gmpy2.mpq(1), gmpy2.mpq(0))]
+    h = hull([xy for polygon in problem.polygons for xy in polygon])
+    for i in range(len(h)):
+        a = h[i]
+        b = h[(i + 1) % len(h)]
+        dx = b[0] - a[0]
+        dy = b[1] - a[1]
+        length = _sqrt(dx * dx + dy * dy)
+        if length is not None and (dx / length, dy / length) not in rs:
+            rs.append((dx / length, dy / length))
+    return rs
+
+# The smallest rectangle with sides along the rotation (cos, sin) around the
+# silhouette, as (area, cos, sin, x0, y0, w, h) where (x0, y0) is its corner
+# in rotated coordinates
+def bounding_box(problem, cos, sin):
+    us = []
+    vs = []
+    for polygon in problem.polygons:
+        for x, y in polygon:
+            us.append(cos * x + sin * y)
+            vs.append(-sin * x + cos * y)
+    x0 = min(us)
+    y0 = min(vs)
+    w = max(us) - x0
+    h = max(vs) - y0
+    return (min(w, 1) * min(h, 1), cos, sin, x0, y0, w, h)
+
+# Cut points of an accordion fold of [0, 1] into width w, and where each
+# lands; the strip is folded back and forth along x = w, 2w, ...
+def accordion(w):
+    cuts = [gmpy2.mpq(0)]
+    while cuts[-1] + w < 1:
+        cuts.append(cuts[-1] + w)
+    cuts.append(gmpy2.mpq(1))
+    lands = []
+    for i, x in enumerate(cuts):
+        k = min(i, len(cuts) - 2)
+        lands.append(x - k * w if k % 2 == 0 else (k + 1) * w - x)
+    return cuts, lands
+
+def _round_down(q, d):
+    return gmpy2.mpq((q.numerator * d) // q.denominator, d)
+
+def _round_up(q, d):
+    return -_round_down(-q, d)
+
+# Folds the unit square into a w by h rectangle (at most 1 by 1), and places
+# it by the Transform t. Returns the parts of a solution as used by
+# solve.write_solution.
+def folded_rectangle(w, h, t):
+    xs, xlands = accordion(w)
+    ys, ylands = accordion(h)
+    sources = []
+    dests = []
+    for y, v in zip(ys, ylands):
+        for x, u in zip(xs, xlands):
+            sources.append((x, y))
+            dests.append(t.map(u, v))
+    n = len(xs)
+    facets = []
+    for j in range(len(ys) - 1):
+        for i in range(n - 1):
+            k = j * n + i
+            facets.append([k, k + 1, k + 1 + n, k + n])
+    return sources, facets, dests
+
+# Folds the square to cover [x0, x0 + w] by [y0, y0 + h] in coordinates
+# rotated by (cos, sin), or as much of it as it can, centred. With d, the
+# corner and sides are first rounded out to multiples of 1/d.
+def cover(cos, sin, x0, y0, w, h, d = None):
+    if w > 1:
+        x0 += (w - 1) / 2
+        w = gmpy2.mpq(1)
+    if h > 1:
+        y0 += (h - 1) / 2
+        h = gmpy2.mpq(1)
+    if d is not None:
+        x = _round_down(x0, d)
+        y = _round_down(y0, d)
+        w = min(1, _round_up(w + x0 - x, d))
+        h = min(1, _round_up(h + y0 - y, d))
+        x0, y0 = x, y
+    t = helper.Transform(cos, sin, cos * x0 - sin * y0, sin * x0 + cos * y0, False)
+    return folded_rectangle(w, h, t)
+
+# An approximate solution: the unit square folded into the smallest rectangle
+# around the silhouette that the supported rotations give, or centred on it if
+# the silhouette is bigger than the square. Takes milliseconds.
+def fold_solution(problem):
+    boxes = [bounding_box(problem, cos, sin) for cos, sin in rotations(problem)]
+    boxes.sort(key = lambda b : b[0])
+    for _, cos, sin, x0, y0, w, h in boxes:
+        for d in denominators:
+            out = io.StringIO()
+            try:
+                solve.write_solution(out, *cover(cos, sin, x0, y0, w, h, d))
+            except ValueError:
+                continue
+            return out.getvalue()
+    raise ValueError("No approximate solution fits the size limit")
+
+# Writes an approximate solution for each pid that doesn't have a solution
+def sweep(pids):
+    os.makedirs(solve.approx_dir, exist_ok = True)
+    done = 0
+    for pid in pids:
+        if os.path.isfile("solutions/" + str(pid)):
+            continue
+        try:
+            x = fold_solution(sil.Problem.read_by_pid(pid))
+        except ValueError as e:
+            print ("Problem " + str(pid) + ": " + str(e))
+            continue
+        solve.write_atomic(os.path.join(solve.approx_dir, str(pid)), "")
+        solve.write_atomic("solutions/" + str(pid), x)
+        done += 1
+    return done
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pids", type = int, nargs = "*",
+            help = "default every problem without a solution")
+    args = parser.parse_args()
+
+    pids = args.pids or sorted(int(x) for x in os.listdir("problems") if x.isdigit())
+    start = time.monotonic()
+    done = sweep(pids)
+    print ("Wrote " + str(done) + " approximate solutions in " +
+            str(round(time.monotonic() - start, 2)) + " s")
@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import multiprocessing
+
+import sil
+import solve
+
+now = time.monotonic
+
+# Relative slowdown of a median or 95th percentile that counts as a regression
+tolerance = 0.2
+
+# Searches expanding fewer states than this are left out of the memory per
+# state, as their growth is mostly the first few pages touched
+memory_min_states = 1000
+
+def features(p):
+    s = p.skeleton
+    num_edges = sum(len(point.edges) for point in s.points) // 2
+    return (num_edges, len(s.facets))
+
+# Picks up to per_stratum problems from each group of problems with similar
+# skeleton size and facet count (rounded to powers of two), with a fixed seed
+def stratified_sample(per_stratum = 3, seed = 0):
+    strata = {}
+    for name in sorted(os.listdir("problems"), key = int):
+        num_edges, num_facets = features(sil.Problem.read_by_pid(name))
+        key = (num_edges.bit_length(), num_facets.bit_length())
+        strata.setdefault(key, []).append(int(name))
+
+    rng = random.Random(seed)
+    pids = []
+    for key in sorted(strata):
+        group = strata[key]
+        pids.extend(rng.sample(group, min(per_stratum, len(group))))
+    return sorted(pids)
+
+def percentile(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+def summarise(times):
+    total = sum(times)
+    return {
+            "total" : total,
+            "throughput" : len(times) / total if total > 0 else 0,
+            "p50" : percentile(times, 0.5),
+            "p95" : percentile(times, 0.95)
+            }
+
+# Times parsing, skeleton construction, Problem.fromfile (through the cache,
+# as the solver uses it) and solve() separately for each problem
+def run(pids, timelimit = 2, repeat = 3):
+    phases = {"parse" : [], "skeleton" : [], "fromfile" : [], "solve" : []}
+    results = {}
+    for pid in pids:
+        filename = "problems/" + str(pid)
+        best = {"parse" : None, "skeleton" : None, "fromfile" : None}
+        for _ in range(repeat):
+            start = now()
+            polygons, edges = sil._read(filename)
+            mid = now()
+            sil.Skeleton(polygons, edges)
+            end = now()
+            p = sil.Problem.fromfile(filename)
+            p.skeleton
+            last = now()
+            for phase, t in (("parse", mid - start), ("skeleton", end - mid), ("fromfile", last - end)):
+                if best[phase] is None or t < best[phase]:
+                    best[phase] = t
+        for phase in best:
+            phases[phase].append(best[phase])
+
+        start = now()
+        x = solve.solve(p, timelimit)
+        phases["solve"].append(now() - start)
+        if x == -1:
+            results[pid] = "timeout"
+        elif x is None:
+            results[pid] = "none"
+        else:
+            results[pid] = "solved"
+
+    report = {phase : summarise(times) for phase, times in phases.items()}
+    return {"pids" : pids, "timelimit" : timelimit, "phases" : report, "results" : results}
+
+# Runs in a child process, so that its peak resident size belongs to one
+# search. Sends back the growth in peak size (in KB) over the search, and the
+# number of states expanded.
+def _memory_worker(pid, timelimit, conn):
+    p = sil.Problem.read_by_pid(pid)
+    p.skeleton
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stats = {}
+    solve.solve(p, timelimit, stats)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((after - before, stats["expanded"]))
+    conn.close()
+
+# Growth in peak memory over each search, and that divided by the number of
+# states expanded for searches expanding at least memory_min_states, in bytes.
+# Problems whose worker died (say, killed for running out of memory) are
+# listed under "failed".
+def memory(pids, timelimit = 2):
+    peaks = []
+    per_state = []
+    failed = []
+    for pid in pids:
+        recv, send = multiprocessing.Pipe(False)
+        proc = multiprocessing.Process(target = _memory_worker, args = (pid, timelimit, send))
+        proc.start()
+        send.close()
+        try:
+            growth, expanded = recv.recv()
+        except EOFError:
+            failed.append(pid)
+            continue
+        finally:
+            proc.join()
+        peaks.append(1024 * growth)
+        if expanded >= memory_min_states:
+            per_state.append(1024 * growth / expanded)
+    report = {}
+    for name, xs in (("peak", peaks), ("per_state", per_state)):
+        if len(xs) > 0:
+            report[name] = {"p50" : percentile(xs, 0.5), "p95" : percentile(xs, 0.95), "max" : max(xs)}
+    report["failed"] = failed
+    return report
+
+def print_memory(report):
+    print("%-10s %12s %12s %12s" % ("memory", "p50", "p95", "max"))
+    units = {"peak" : (1024, "KB"), "per_state" : (1, "B")}
+    for name, (k, unit) in units.items():
+        if name in report:
+            r = report[name]
+            print("%-10s %12s %12s %12s" % ((name,) + tuple("%.1f %s" % (r[s] / k, unit)
+                    for s in ("p50", "p95", "max"))))
+    if len(report["failed"]) > 0:
+        print("Failed:", " ".join(str(pid) for pid in report["failed"]))
+
+def print_report(report):
+    print("%-10s %10s %12s %10s %10s" % ("phase", "total (s)", "problems/s", "p50 (ms)", "p95 (ms)"))
+    for phase, r in report["phases"].items():
+        print("%-10s %10.3f %12.1f %10.2f %10.2f" %
+                (phase, r["total"], r["throughput"], 1000 * r["p50"], 1000 * r["p95"]))
+    counts = {}
+    for x in report["results"].values():
+        counts[x] = counts.get(x, 0) + 1
+    print("Results:", ", ".join(k + " " + str(v) for k, v in sorted(counts.items())))
+
+# Returns a list of regressions of report against baseline
+def compare(report, baseline):
+    regressions = []
+    for phase, r in report["phases"].items():
+        if phase not in baseline["phases"]:
+            continue
+        b = baseline["phases"][phase]
+        for stat in ("p50", "p95"):
+            if b[stat] > 0 and r[stat] > b[stat] * (1 + tolerance):
+                regressions.append("%s %s: %.2f ms -> %.2f ms" %
+                        (phase, stat, 1000 * b[stat], 1000 * r[stat]))
+
+    for pid, x in baseline["results"].items():
+        y = report["results"].get(int(pid))
+        if x == "solved" and y is not None and y != "solved":
+            regressions.append("problem " + str(pid) + ": no longer solved (" + y + ")")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--per-stratum", type = int, default = 3)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("-t", "--timelimit", type = float, default = 2)
+    parser.add_argument("--repeat", type = int, default = 3,
+            help = "times to repeat the load phases, keeping the fastest")
+    parser.add_argument("--memory", action = "store_true",
+            help = "measure peak memory per search instead of time")
+    parser.add_argument("--save", metavar = "FILE", help = "save the results as a baseline")
+    parser.add_argument("--compare", metavar = "FILE",
+            help = "compare with a saved baseline, reusing its sample")
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        pids = baseline["pids"]
+        timelimit = baseline["timelimit"]
+    else:
+        pids = stratified_sample(args.per_stratum, args.seed)
+        timelimit = args.timelimit
+
+    print("Benchmarking " + str(len(pids)) + " problems")
+    if args.memory:
+        print_memory(memory(pids, timelimit))
+        sys.exit(0)
+    report = run(pids, timelimit, args.repeat)
+    print_report(report)
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent = 1, sort_keys = True)
+
+    if baseline is not None:
+        regressions = compare(report, baseline)
+        for r in regressions:
+            print("REGRESSION " + r)
+        if len(regressions) > 0:
+            sys.exit(1)
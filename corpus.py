@@ -0,0 +1,113 @@
+import os
+import re
+import mmap
+import hashlib
+import argparse
+
+import sil
+
+# Summaries of every problem file, kept in sil.cache_dir so that questions
+# about the corpus are answered without opening the problems. An entry is
+# rescanned only when its file's size or modification time changes.
+index_name = "index"
+_index_version = 1
+
+_denominator = re.compile(rb"/(\d+)")
+
+# Summarises one problem file, read through a memory map: its sha1, the
+# number of polygons, polygon vertices and skeleton edges, and the most
+# decimal digits in any denominator (1 if every coordinate is an integer)
+def scan(path):
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        entry = {"size" : st.st_size, "mtime" : st.st_mtime_ns}
+        if st.st_size == 0:
+            entry.update(hash = hashlib.sha1().hexdigest(), polygons = 0, vertices = 0,
+                    edges = 0, den_digits = 0)
+            return entry
+
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as m:
+            entry["hash"] = hashlib.sha1(m).hexdigest()
+            npolygons = int(m.readline())
+            vertices = 0
+            for i in range(npolygons):
+                k = int(m.readline())
+                vertices += k
+                for j in range(k):
+                    m.readline()
+            entry["polygons"] = npolygons
+            entry["vertices"] = vertices
+            entry["edges"] = int(m.readline())
+            entry["den_digits"] = max([1] + [len(d) for d in _denominator.findall(m)])
+    return entry
+
+# With the cache disabled the index is rebuilt every time and not saved
+def _index_path():
+    if sil.cache_dir is None:
+        return None
+    return os.path.join(sil.cache_dir, index_name)
+
+def _read_index():
+    path = _index_path()
+    if path is None:
+        return {}
+    saved = sil.read_marshal(path, None)
+    if isinstance(saved, tuple) and len(saved) == 2 and saved[0] == _index_version:
+        return saved[1]
+    return {}
+
+def _write_index(entries):
+    path = _index_path()
+    if path is not None:
+        sil.write_marshal(path, (_index_version, entries))
+
+# Returns a dict from each pid to its entry. With refresh, the directory is
+# listed and new or changed files are scanned (only stat is used on the
+# others); without, the saved index is returned as it is.
+def load(dirname = "problems", refresh = True):
+    entries = _read_index()
+    if refresh:
+        changed = False
+        seen = set()
+        for d in os.scandir(dirname):
+            if not d.name.isdigit():
+                continue
+            seen.add(d.name)
+            st = d.stat()
+            e = entries.get(d.name)
+            if e is None or e["size"] != st.st_size or e["mtime"] != st.st_mtime_ns:
+                entries[d.name] = scan(d.path)
+                changed = True
+        for name in list(entries):
+            if name not in seen:
+                del entries[name]
+                changed = True
+        if changed:
+            _write_index(entries)
+    return {int(name) : e for name, e in entries.items()}
+
+# The pids whose entries satisfy pred, in order
+def select(pred, dirname = "problems", refresh = True):
+    return sorted(pid for pid, e in load(dirname, refresh).items() if pred(e))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-edges", type = int, help = "fewer than this many skeleton edges")
+    parser.add_argument("--max-vertices", type = int, help = "fewer than this many polygon vertices")
+    parser.add_argument("--max-den-digits", type = int,
+            help = "denominators with fewer than this many digits")
+    parser.add_argument("--no-refresh", action = "store_true",
+            help = "use the saved index without looking at problems/")
+    parser.add_argument("--count", action = "store_true", help = "only print how many match")
+    args = parser.parse_args()
+
+    def pred(e):
+        return ((args.max_edges is None or e["edges"] < args.max_edges) and
+                (args.max_vertices is None or e["vertices"] < args.max_vertices) and
+                (args.max_den_digits is None or e["den_digits"] < args.max_den_digits))
+
+    pids = select(pred, refresh = not args.no_refresh)
+    if args.count:
+        print (len(pids))
+    else:
+        print (" ".join(str(pid) for pid in pids))
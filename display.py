@@ -1,14 +1,23 @@
 import time
-import os.path
 import pygame
 import collections
 
 import sil
 import solve
+import corpus
 
 pixels = 600
-pygame.init()
-surface = pygame.display.set_mode((pixels, pixels))
+
+# The window, opened the first time something is drawn, so that importing
+# this module (or using render.py) needs no display
+surface = None
+
+def window():
+    global surface
+    if surface is None:
+        pygame.init()
+        surface = pygame.display.set_mode((pixels, pixels))
+    return surface
 
 c_black = pygame.Color(0, 0, 0)
 c_poly = pygame.Color(0, 255, 0)
@@ -60,6 +69,7 @@ def display(p):
     def ty(y):
         return pixels - int(pixels * (float((y - ys_[0]) / dx) + 0.25) / (3 / 2))
 
+    surface = window()
     surface.fill(c_black)
 
     for i, poly in enumerate(p.polygons):
@@ -87,6 +97,7 @@ def display_ps(ps):
     def t(xy):
         return (int(pixels * xy[0]), pixels - int(pixels * xy[1]))
 
+    surface = window()
     surface.fill(c_black)
     for facet in ps.facets:
         points = [t(xy) for xy in facet.points]
@@ -101,6 +112,7 @@ def foo(pid):
     display_ps(ps)
 
 def prompt_user():
+    index = corpus.load()
     while True:
         x = input("Choose a problem id to display or press enter to quit: ")
         if len(x) < 1:
@@ -112,9 +124,12 @@ def prompt_user():
             print("Not a number.")
             continue
 
-        if not os.path.isfile("problems/" + str(pid)):
+        if pid not in index:
             print("There is no problem with that id.")
             continue
+        e = index[pid]
+        print("Polygons:", e["polygons"], " vertices:", e["vertices"], " skeleton edges:", e["edges"],
+                " denominator digits:", e["den_digits"])
 
         p = sil.Problem.read_by_pid(pid)
         print_info_about(p)
@@ -1,4 +1,8 @@
+import itertools
+
 class Transform:
+    __slots__ = ("cos", "sin", "dx", "dy", "flip")
+
     def __init__(self, cos, sin, dx, dy, flip):
         self.cos = cos
         self.sin = sin
@@ -6,6 +10,9 @@ class Transform:
         self.dy = dy
         self.flip = flip
 
+    def key(self):
+        return (self.cos, self.sin, self.dx, self.dy, self.flip)
+
     def map(self, x, y):
         if self.flip:
             return (self.cos * x - self.sin * y + self.dx,-(self.sin * x + self.cos * y + self.dy))
@@ -87,6 +94,208 @@ def intersect(a, b, c, d):
         # Line are parallel
         return False
 
-    s = (-day * (a[0] - c[0]) + dax * (a[1] - c[1])) / denom
-    t = ( dcx * (a[1] - c[1]) - dcy * (a[0] - c[0])) / denom
-    return (s > 0 and s < 1 and t > 0 and t < 1)
+    # s = sn / denom and t = tn / denom, compared without dividing
+    sn = -day * (a[0] - c[0]) + dax * (a[1] - c[1])
+    tn = dcx * (a[1] - c[1]) - dcy * (a[0] - c[0])
+    if denom < 0:
+        denom, sn, tn = -denom, -sn, -tn
+    return (sn > 0 and sn < denom and tn > 0 and tn < denom)
+
+# Floating point filters for the predicates above. Orientations computed in
+# floating point from rationals of absolute value at most m are within
+# orient_error * m * m of the exact value, so only signs beyond that are
+# trusted and anything closer falls back to exact arithmetic.
+orient_error = 1e-13
+
+def _orient(a, b, c):
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+def fxy(xy):
+    return (float(xy[0]), float(xy[1]))
+
+# Returns True if the closed segments fa-fb and fc-fd (float coordinates of
+# absolute value at most m) certainly do not meet, False if unsure
+def apart(fa, fb, fc, fd, m = 1):
+    eps = orient_error * m * m
+    o1 = _orient(fa, fb, fc)
+    o2 = _orient(fa, fb, fd)
+    if (o1 > eps and o2 > eps) or (o1 < -eps and o2 < -eps):
+        return True
+    o3 = _orient(fc, fd, fa)
+    o4 = _orient(fc, fd, fb)
+    return (o3 > eps and o4 > eps) or (o3 < -eps and o4 < -eps)
+
+# Same as intersect, given also the coordinates as floats in the unit square
+def intersect_filtered(a, b, c, d, fa, fb, fc, fd):
+    eps = orient_error
+    ax, ay = fa
+    bx, by = fb
+    cx, cy = fc
+    dx, dy = fd
+
+    ux = bx - ax
+    uy = by - ay
+    o1 = ux * (cy - ay) - uy * (cx - ax)
+    o2 = ux * (dy - ay) - uy * (dx - ax)
+    if (o1 > eps and o2 > eps) or (o1 < -eps and o2 < -eps):
+        return False
+    vx = dx - cx
+    vy = dy - cy
+    o3 = vx * (ay - cy) - vy * (ax - cx)
+    o4 = vx * (by - cy) - vy * (bx - cx)
+    if (o3 > eps and o4 > eps) or (o3 < -eps and o4 < -eps):
+        return False
+    if abs(o1) > eps and abs(o2) > eps and abs(o3) > eps and abs(o4) > eps:
+        # Each pair of endpoints is certainly on opposite sides of the other segment
+        return True
+    # Segments with a common endpoint can only meet there (or be parallel)
+    if a == c or a == d or b == c or b == d:
+        return False
+    return intersect(a, b, c, d)
+
+def _cell(v, n):
+    return min(int(v * n), n - 1)
+
+# Returns the (row, column) cells of an n by n grid over the unit square that
+# the segment a-b passes through (possibly with a few extra cells where it
+# touches a cell boundary). Coordinates must be exact rationals.
+def segment_cells(a, b, n):
+    if a[1] > b[1]:
+        a, b = b, a
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+
+    cells = []
+    for r in range(_cell(a[1], n), _cell(b[1], n) + 1):
+        if dy == 0:
+            x0 = a[0]
+            x1 = b[0]
+        else:
+            # Where the segment enters and leaves the row, scaled by n
+            y0 = max(a[1] * n, r)
+            y1 = min(b[1] * n, r + 1)
+            x0 = a[0] + dx * (y0 - a[1] * n) / (dy * n)
+            x1 = a[0] + dx * (y1 - a[1] * n) / (dy * n)
+        c0 = _cell(x0, n)
+        c1 = _cell(x1, n)
+        if c0 > c1:
+            c0, c1 = c1, c0
+        for c in range(c0, c1 + 1):
+            cells.append((r, c))
+    return cells
+
+# An immutable list that can only be appended to. Appending shares the whole
+# existing list, so each version costs O(1) extra memory.
+class Chain:
+    __slots__ = ("item", "rest", "size")
+
+    def __init__(self, item = None, rest = None):
+        self.item = item
+        self.rest = rest
+        self.size = 0 if rest is None else rest.size + 1
+
+    def append(self, item):
+        return Chain(item, self)
+
+    def extend(self, items):
+        c = self
+        for item in items:
+            c = Chain(item, c)
+        return c
+
+    def __len__(self):
+        return self.size
+
+    # Oldest item first
+    def __iter__(self):
+        items = []
+        c = self
+        while c.size > 0:
+            items.append(c.item)
+            c = c.rest
+        return reversed(items)
+
+# An immutable set, split into buckets by hash so that an update only copies
+# the buckets it touches and shares the rest with the old set
+class BucketSet:
+    __slots__ = ("buckets", "size")
+    nbuckets = 8
+
+    def __init__(self, buckets = None, size = 0):
+        if buckets is None:
+            buckets = (frozenset(),) * BucketSet.nbuckets
+        self.buckets = buckets
+        self.size = size
+
+    def update(self, added, removed):
+        buckets = list(self.buckets)
+        size = self.size
+        for x in added:
+            i = hash(x) % BucketSet.nbuckets
+            if x not in buckets[i]:
+                buckets[i] = buckets[i] | {x}
+                size += 1
+        for x in removed:
+            i = hash(x) % BucketSet.nbuckets
+            if x in buckets[i]:
+                buckets[i] = buckets[i] - {x}
+                size -= 1
+        return BucketSet(tuple(buckets), size)
+
+    def __contains__(self, x):
+        return x in self.buckets[hash(x) % BucketSet.nbuckets]
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.buckets)
+
+# An immutable dict, split into buckets like BucketSet
+class BucketMap:
+    __slots__ = ("buckets",)
+    nbuckets = 8
+
+    def __init__(self, buckets = None):
+        if buckets is None:
+            buckets = ({},) * BucketMap.nbuckets
+        self.buckets = buckets
+
+    def get(self, key, default = None):
+        return self.buckets[hash(key) % BucketMap.nbuckets].get(key, default)
+
+    # Sets each key in changes to its value, or deletes it if the value is None
+    def update(self, changes):
+        buckets = list(self.buckets)
+        copied = set()
+        for key, value in changes.items():
+            i = hash(key) % BucketMap.nbuckets
+            if i not in copied:
+                buckets[i] = dict(buckets[i])
+                copied.add(i)
+            if value is None:
+                buckets[i].pop(key, None)
+            else:
+                buckets[i][key] = value
+        return BucketMap(tuple(buckets))
+
+# An immutable leftist heap, smallest key on top. A heap is None when empty,
+# otherwise a tuple (rank, key, item, left, right).
+def heap_merge(h1, h2):
+    if h1 is None:
+        return h2
+    if h2 is None:
+        return h1
+    if h2[1] < h1[1]:
+        h1, h2 = h2, h1
+    _, key, item, left, right = h1
+    right = heap_merge(right, h2)
+    if left is None or left[0] < right[0]:
+        left, right = right, left
+    return ((0 if right is None else right[0]) + 1, key, item, left, right)
+
+def heap_push(h, key, item):
+    return heap_merge(h, (1, key, item, None, None))
+
+def heap_pop(h):
+    return heap_merge(h[3], h[4])
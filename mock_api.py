@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import json
+import random
+import hashlib
+import threading
+import http.server
+
+# A stand-in for the contest API, for trying out web.py without the real
+# server. Run
+#     python mock_api.py [port]
+# and set web.api = "http://localhost:<port>/api". It serves the files in
+# problems/ as blobs listed in a single snapshot, accepts submissions, and
+# like the real server answers 429 to requests less than min_interval
+# seconds apart. A fraction fail_rate of requests fail with 503 at random.
+
+min_interval = 1
+fail_rate = 0.05
+apikey = "248-b09bb7ee975fa210cd17aa20ad96bccc"
+
+class MockState:
+    def __init__(self, problems = "problems", limit = None):
+        self.blobs = {}
+        self.lock = threading.Lock()
+        self.last = None
+        self.counts = {}
+        self.submitted = []
+
+        entries = []
+        names = sorted((x for x in os.listdir(problems) if x.isdigit()), key = int)
+        for name in names[:limit]:
+            with open(problems + "/" + name) as f:
+                text = f.read()
+            h = hashlib.sha1(text.encode()).hexdigest()
+            self.blobs[h] = text
+            entries.append({"problem_id" : int(name), "problem_spec_hash" : h})
+        snapshot = json.dumps({"problems" : entries})
+        self.snapshot_hash = hashlib.sha1(snapshot.encode()).hexdigest()
+        self.blobs[self.snapshot_hash] = snapshot
+
+    # Returns the status to give a request arriving now
+    def admit(self):
+        with self.lock:
+            t = time.monotonic()
+            early = self.last is not None and t - self.last < min_interval
+            self.last = t
+            if early:
+                status = 429
+            elif random.random() < fail_rate:
+                status = 503
+            else:
+                status = 200
+            self.counts[status] = self.counts.get(status, 0) + 1
+            return status
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    def send(self, status, body):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self, body = None):
+        state = self.server.state
+        if self.headers.get("X-API-Key") != apikey:
+            return self.send(403, "bad key")
+        status = state.admit()
+        if status != 200:
+            return self.send(status, "try again")
+
+        path = self.path
+        if path == "/api/hello":
+            return self.send(200, json.dumps({"ok" : True, "greeting" : "Hello"}))
+        if path == "/api/snapshot/list":
+            snapshots = [{"snapshot_time" : 0, "snapshot_hash" : state.snapshot_hash}]
+            return self.send(200, json.dumps({"ok" : True, "snapshots" : snapshots}))
+        if path.startswith("/api/blob/"):
+            blob = state.blobs.get(path[len("/api/blob/"):])
+            if blob is None:
+                return self.send(404, "no such blob")
+            return self.send(200, blob)
+        if path in ("/api/solution/submit", "/api/problem/submit") and body is not None:
+            with state.lock:
+                state.submitted.append((path, body))
+            return self.send(200, json.dumps({"ok" : True}))
+        return self.send(404, "not found")
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.handle_request(self.rfile.read(length))
+
+    def log_message(self, format, *args):
+        pass
+
+# Starts a server in a background thread and returns it; server.state holds
+# what it has seen
+def serve(port = 0, problems = "problems", limit = None):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    server.state = MockState(problems, limit)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8016
+    server = serve(port)
+    print ("Serving on http://127.0.0.1:" + str(server.server_address[1]) + "/api")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print (server.state.counts)
@@ -0,0 +1,185 @@
+import os
+import time
+import zlib
+import struct
+import argparse
+import multiprocessing
+
+import numpy
+
+import sil
+import corpus
+import validate
+
+# Draws problems and (partial) solutions into NumPy arrays without a window,
+# in the colours display.py uses, and lays many out as PNG contact sheets.
+# Images are (rows, columns, 3) uint8 arrays with the top row first.
+
+tile_pixels = 128
+sheet_columns = 16
+sheet_rows = 12
+# Pixels between tiles on a sheet
+gap = 2
+
+c_black = (0, 0, 0)
+c_poly = (0, 255, 0)
+c_poly_int = (40, 40, 40)
+c_skeleton = (255, 0, 0)
+c_gap = (90, 90, 90)
+
+# Total winding number of the polygons around the centre of each pixel, bottom
+# row first. Coordinates are floats in box = ((x0, x1), (y0, y1)).
+def _winding(polygons, box, n):
+    winding = numpy.zeros((n, n), dtype = numpy.int32)
+    for polygon in polygons:
+        winding += validate.raster(polygon, box, n)
+    return winding
+
+# Draws the segments ((ax, ay), (bx, by)) one pixel wide, all at once
+def _lines(image, segments, box, color):
+    if len(segments) == 0:
+        return
+    n = image.shape[0]
+    (x0, x1), (y0, y1) = box
+    s = numpy.array(segments, dtype = float)
+    px = (s[:, :, 0] - x0) * (n / (x1 - x0))
+    py = (s[:, :, 1] - y0) * (n / (y1 - y0))
+    steps = int(max(numpy.abs(px[:, 1] - px[:, 0]).max(), numpy.abs(py[:, 1] - py[:, 0]).max())) + 1
+    t = numpy.linspace(0, 1, steps + 1)
+    xs = numpy.floor(px[:, :1] + t * (px[:, 1:] - px[:, :1])).astype(numpy.int64).ravel()
+    ys = numpy.floor(py[:, :1] + t * (py[:, 1:] - py[:, :1])).astype(numpy.int64).ravel()
+    inside = (xs >= 0) & (xs < n) & (ys >= 0) & (ys < n)
+    image[n - 1 - ys[inside], xs[inside]] = color
+
+# The problem's silhouette, holes and skeleton, framed as display.display
+# frames them. Coordinates are made relative to the bounding box exactly
+# before becoming floats, so far away problems keep their precision.
+def problem_image(problem, n = tile_pixels):
+    (xmin, xmax), (ymin, ymax) = problem.bounds()
+    d = max(xmax - xmin, ymax - ymin)
+    if d == 0:
+        d = 1
+
+    def f(xy):
+        return (float((xy[0] - xmin) / d), float((xy[1] - ymin) / d))
+
+    box = ((-0.25, 1.25), (-0.25, 1.25))
+    image = numpy.zeros((n, n, 3), dtype = numpy.uint8)
+    image[:] = c_black
+    polygons = [[f(xy) for xy in polygon] for polygon in problem.polygons]
+    holes = [p for p, a in zip(polygons, problem.areas()) if a < 0]
+    image[::-1][_winding(holes, box, n) != 0] = c_poly_int
+    image[::-1][_winding(polygons, box, n) > 0] = c_poly
+    _lines(image, [(f(a), f(b)) for a, b in problem.raw_skeleton], box, c_skeleton)
+    return image
+
+# Facets given by their points in the unit square, filled and outlined as
+# display.display_ps draws a PartialSolution
+def facets_image(facets, n = tile_pixels):
+    box = ((0, 1), (0, 1))
+    image = numpy.zeros((n, n, 3), dtype = numpy.uint8)
+    image[:] = c_black
+    polygons = [[(float(x), float(y)) for x, y in facet] for facet in facets]
+    image[::-1][_winding(polygons, box, n) != 0] = c_poly
+    segments = []
+    for polygon in polygons:
+        for i in range(len(polygon)):
+            segments.append((polygon[i], polygon[(i + 1) % len(polygon)]))
+    _lines(image, segments, box, c_skeleton)
+    return image
+
+def partial_solution_image(ps, n = tile_pixels):
+    return facets_image([facet.points for facet in ps.facets], n)
+
+# The source facets of solutions/<pid>
+def solution_image(pid, n = tile_pixels):
+    sources, facets, _ = sil.read_solution("solutions/" + str(pid))
+    return facets_image([[sources[i] for i in f] for f in facets], n)
+
+# Lays the images out in rows of columns, all the same size
+def contact_sheet(images, columns = sheet_columns):
+    n = images[0].shape[0]
+    rows = (len(images) + columns - 1) // columns
+    sheet = numpy.zeros((rows * (n + gap) + gap, columns * (n + gap) + gap, 3), dtype = numpy.uint8)
+    sheet[:] = c_gap
+    for k, image in enumerate(images):
+        y = gap + (k // columns) * (n + gap)
+        x = gap + (k % columns) * (n + gap)
+        sheet[y : y + n, x : x + n] = image
+    return sheet
+
+def _chunk(kind, data):
+    return (struct.pack(">I", len(data)) + kind + data +
+            struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+# Writes an RGB image as a PNG, via a temporary file and rename
+def write_png(filename, image):
+    h, w, _ = image.shape
+    raw = numpy.zeros((h, 1 + 3 * w), dtype = numpy.uint8)
+    raw[:, 1:] = image.reshape(h, 3 * w)
+    data = (b"\x89PNG\r\n\x1a\n" +
+            _chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)) +
+            _chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) +
+            _chunk(b"IEND", b""))
+    tmp = filename + "." + str(os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, filename)
+
+# Runs in a worker process; a problem or solution that can't be read is left
+# blank
+def _tile(args):
+    pid, n, solutions = args
+    try:
+        if solutions:
+            return solution_image(pid, n)
+        return problem_image(sil.Problem.read_by_pid(pid), n)
+    except (OSError, ValueError):
+        return numpy.zeros((n, n, 3), dtype = numpy.uint8)
+
+# Renders the pids onto sheets of columns by rows tiles in dirname, named
+# sheet-<k>.png, each with a sheet-<k>.txt listing its pids row by row.
+# Returns the number of sheets.
+def render_sheets(pids, dirname = "sheets", n = tile_pixels, columns = sheet_columns,
+        rows = sheet_rows, jobs = None, solutions = False):
+    os.makedirs(dirname, exist_ok = True)
+    per_sheet = columns * rows
+    sheets = 0
+    with multiprocessing.Pool(jobs) as pool:
+        tiles = pool.imap(_tile, [(pid, n, solutions) for pid in pids], chunksize = 16)
+        for start in range(0, len(pids), per_sheet):
+            some = pids[start : start + per_sheet]
+            images = [next(tiles) for pid in some]
+            name = os.path.join(dirname, "sheet-" + str(sheets).zfill(4))
+            write_png(name + ".png", contact_sheet(images, columns))
+            with open(name + ".txt", 'w') as f:
+                for i in range(0, len(some), columns):
+                    f.write(" ".join(str(pid) for pid in some[i : i + columns]) + "\n")
+            sheets += 1
+    return sheets
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pids", type = int, nargs = "*",
+            help = "default every problem, or every solution with --solutions")
+    parser.add_argument("-o", "--output", default = "sheets")
+    parser.add_argument("-n", "--pixels", type = int, default = tile_pixels,
+            help = "pixels along each side of a tile")
+    parser.add_argument("--columns", type = int, default = sheet_columns)
+    parser.add_argument("--rows", type = int, default = sheet_rows)
+    parser.add_argument("-j", "--jobs", type = int, default = None)
+    parser.add_argument("--solutions", action = "store_true",
+            help = "draw the source facets of solutions/ instead of the problems")
+    args = parser.parse_args()
+
+    if args.pids:
+        pids = args.pids
+    elif args.solutions:
+        pids = validate.solution_pids()
+    else:
+        pids = sorted(corpus.load())
+    start = time.monotonic()
+    sheets = render_sheets(pids, args.output, args.pixels, args.columns, args.rows,
+            args.jobs, args.solutions)
+    print ("Drew " + str(len(pids)) + " tiles on " + str(sheets) + " sheets in " +
+            str(round(time.monotonic() - start, 2)) + " s")
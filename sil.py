@@ -1,10 +1,16 @@
+import os
 import functools
-import fractions
+import hashlib
+import marshal
 import gmpy2 # requires python 3.4
 
+import helper
+
+# All coordinates are gmpy2 rationals; everything downstream (Transform,
+# PartialSolution) just does arithmetic on them, so stays exact
 def _readcoord(s):
     x, y = s.strip().split(",")
-    return (fractions.Fraction(x), fractions.Fraction(y))
+    return (gmpy2.mpq(x), gmpy2.mpq(y))
 
 # positive result if a comes after b
 def arg_cmp(a, b):
@@ -43,14 +49,55 @@ def _intersection(a, b, c, d):
         # Line are parallel
         return None
 
-    s = (-day * (a[0] - c[0]) + dax * (a[1] - c[1])) / denom
-    t = ( dcx * (a[1] - c[1]) - dcy * (a[0] - c[0])) / denom
-    if s >= 0 and s <= 1 and t >= 0 and t <= 1:
+    # s = sn / denom and t = tn / denom; only divide once we know they hit
+    sn = -day * (a[0] - c[0]) + dax * (a[1] - c[1])
+    tn = dcx * (a[1] - c[1]) - dcy * (a[0] - c[0])
+    if denom < 0:
+        denom, sn, tn = -denom, -sn, -tn
+    if sn >= 0 and sn <= denom and tn >= 0 and tn <= denom:
+        t = tn / denom
         return (a[0] + t * dax, a[1] + t * day)
     else:
         return None
 
+# Returns, for each edge, the set of its endpoints and the points where other
+# edges touch it. Sweeps over the edges in order of their left end, so only
+# pairs whose bounding boxes overlap, and which a floating point test can't
+# rule out, are passed to _intersection.
+def _split_points(edges):
+    boxes = []
+    for a, b in edges:
+        boxes.append((min(a[0], b[0]), max(a[0], b[0]), min(a[1], b[1]), max(a[1], b[1])))
+
+    try:
+        fedges = [(helper.fxy(a), helper.fxy(b)) for a, b in edges]
+        m = max([1] + [abs(v) for fa, fb in fedges for v in fa + fb])
+    except OverflowError:
+        fedges = None
+
+    xys = [set(e) for e in edges]
+    active = []
+    for i in sorted(range(len(edges)), key = lambda i : boxes[i][0]):
+        x0, x1, y0, y1 = boxes[i]
+        active = [j for j in active if boxes[j][1] >= x0]
+        a, b = edges[i]
+        for j in active:
+            if boxes[j][2] <= y1 and boxes[j][3] >= y0:
+                if fedges is not None and helper.apart(fedges[i][0], fedges[i][1],
+                        fedges[j][0], fedges[j][1], m):
+                    continue
+                xy = _intersection(a, b, edges[j][0], edges[j][1])
+                if xy is not None:
+                    xys[i].add(xy)
+                    xys[j].add(xy)
+        active.append(i)
+    return xys
+
+# The skeleton classes have __slots__, as there are many of each and the
+# solver holds them for the whole search
 class SkPoint:
+    __slots__ = ("xy", "x", "y", "edges", "facets")
+
     def __init__(self, xy):
         self.xy = xy
         self.x = xy[0]
@@ -76,7 +123,6 @@ class SkPoint:
                 if a[1] is self:
                     e.far = (p, j)
                     break
-            e.init2()
 
     def init4(self):
         for i in range(len(self.edges)):
@@ -98,16 +144,30 @@ class SkPoint:
                 f.points = points
 
 class SkEdge:
-    def __init__(self):
-        pass
+    __slots__ = ("near", "far", "left", "_rational", "_length")
 
-    def init2(self):
-        f = self.length_sq()
-        self.rational = gmpy2.is_square(f.numerator) and gmpy2.is_square(f.denominator)
+    def __init__(self):
+        # Whether the length is rational, and the length if so; worked out on
+        # first use, since most edges are never asked
+        self._rational = None
+        self._length = None
+
+    @property
+    def rational(self):
+        if self._rational is None:
+            f = self.length_sq()
+            self._rational = bool(gmpy2.is_square(f.numerator) and gmpy2.is_square(f.denominator))
+            if self._rational:
+                n = gmpy2.iroot(f.numerator, 2)[0]
+                d = gmpy2.iroot(f.denominator, 2)[0]
+                self._length = gmpy2.mpq(n, d)
+        return self._rational
+
+    @property
+    def length(self):
         if self.rational:
-            n = int(gmpy2.iroot(f.numerator, 2)[0])
-            d = int(gmpy2.iroot(f.denominator, 2)[0])
-            self.length = fractions.Fraction(n, d)
+            return self._length
+        return None
 
     def length_sq(self):
         p = self.near[0]
@@ -115,6 +175,8 @@ class SkEdge:
         return (p.x - q.x) ** 2 + (p.y - q.y) ** 2
 
 class SkFacet:
+    __slots__ = ("points", "interior", "size", "index")
+
     def __init__(self):
         pass
 
@@ -163,6 +225,57 @@ class SkFacet:
             a += p.x * q.y - p.y * q.x
         return a / 2
 
+# Returns a function telling how many edges of the polygons contain the
+# segment from a to b, which lies on no other skeleton edge. Polygon edges
+# are grouped by the line they lie on, so each query is a dict lookup.
+def _boundary_counter(polygons):
+    def line(a, b):
+        if a[0] == b[0]:
+            return (True, a[0]), a[1], b[1]
+        slope = (b[1] - a[1]) / (b[0] - a[0])
+        return (False, slope, a[1] - slope * a[0]), a[0], b[0]
+
+    lines = {}
+    for polygon in polygons:
+        for i in range(len(polygon)):
+            key, s, t = line(polygon[i], polygon[(i + 1) % len(polygon)])
+            lines.setdefault(key, []).append((min(s, t), max(s, t)))
+
+    def count(a, b):
+        key, s, t = line(a, b)
+        s, t = min(s, t), max(s, t)
+        return sum(1 for lo, hi in lines.get(key, ()) if lo <= s and t <= hi)
+    return count
+
+# Sets interior on every facet. Crossing an edge that lies along an odd
+# number of polygon edges switches between inside and outside the
+# silhouette, and any other edge doesn't, so one facet in each connected
+# piece is tested with check_interior and the others follow by walking
+# across edges. Facets without positive area are the outsides of pieces.
+def _classify_interior(all_facets, polygons):
+    boundary = _boundary_counter(polygons)
+    areas = {}
+    for facet in all_facets:
+        facet.interior = None
+        areas[facet] = facet.area()
+        if areas[facet] <= 0:
+            facet.interior = False
+
+    for facet in all_facets:
+        if facet.interior is not None:
+            continue
+        facet.check_interior(polygons)
+        stack = [facet]
+        while len(stack) > 0:
+            f = stack.pop()
+            for point, i in f.points:
+                e, other = point.edges[i]
+                q, j = e.far
+                g = q.facets[j]
+                if g.interior is None:
+                    g.interior = f.interior != (boundary(point.xy, other.xy) % 2 == 1)
+                    stack.append(g)
+
 class Skeleton:
     def __init__(self, polygons, edges):
         # self.original = edges
@@ -170,15 +283,7 @@ class Skeleton:
 
     def compute_points(self, polygons, edges):
         xy2neighbors = {}
-        for e1 in edges:
-            xys = set()
-            xys.add(e1[0])
-            xys.add(e1[1])
-            for e2 in edges:
-                xy = _intersection(e1[0], e1[1], e2[0], e2[1])
-                if xy is not None:
-                    xys.add(xy)
-
+        for xys in _split_points(edges):
             xys = sorted(xys)
 
             for i, xy in enumerate(xys):
@@ -205,47 +310,318 @@ class Skeleton:
         for point in points:
             point.init4()
 
-        self.points = points
-
         all_facets = set()
         for point in points:
             for facet in point.facets:
                 all_facets.add(facet)
         all_facets = list(all_facets)
 
-        facets = []
-        for facet in all_facets:
-            facet.check_interior(polygons)
-            if facet.interior:
-                facets.append(facet)
+        _classify_interior(all_facets, polygons)
+
+        self.set_parts(points, all_facets)
 
+    def set_parts(self, points, all_facets):
+        self.points = points
         self.all_facets = all_facets
-        self.facets = facets
+        self.facets = [facet for facet in all_facets if facet.interior]
+        # Interior facets have positive area, computed once here, and are
+        # numbered by their position in facets
+        for i, facet in enumerate(self.facets):
+            facet.size = facet.area()
+            facet.index = i
+        self.total_size = sum(facet.size for facet in self.facets)
+        self.min_size = min([facet.size for facet in self.facets], default = 0)
+
+    # Builds a Skeleton from already connected points and facets
+    def fromparts(points, all_facets):
+        s = Skeleton.__new__(Skeleton)
+        s.set_parts(points, all_facets)
+        return s
+
+def _parse(text):
+    lines = iter(text.splitlines())
+    polygons = []
+    n = int(next(lines))
+    for i in range(n):
+        k = int(next(lines))
+        polygon = []
+        for j in range(k):
+            polygon.append(_readcoord(next(lines)))
+        polygons.append(polygon)
+
+    skeleton = []
+    n = int(next(lines))
+    for i in range(n):
+        a, b = next(lines).split()
+        skeleton.append((_readcoord(a), _readcoord(b)))
+
+    return polygons, skeleton
+
+def _read(filename):
+    with open(filename) as f:
+        return _parse(f.read())
+
+# Reads a solution back: the source points, the facets as lists of indices
+# into them, and the destination points. Works on whitespace separated tokens
+# and converts each distinct number only once.
+def parse_solution(text):
+    tokens = text.split()
+    numbers = {}
+    pos = 0
+
+    def count():
+        nonlocal pos
+        pos += 1
+        return int(tokens[pos - 1])
+
+    def points(n):
+        nonlocal pos
+        if pos + n > len(tokens):
+            raise ValueError("Solution is truncated")
+        xys = []
+        for token in tokens[pos : pos + n]:
+            xy = []
+            for s in token.split(","):
+                q = numbers.get(s)
+                if q is None:
+                    q = numbers[s] = gmpy2.mpq(s)
+                xy.append(q)
+            if len(xy) != 2:
+                raise ValueError("Bad point " + token)
+            xys.append(tuple(xy))
+        pos += n
+        return xys
+
+    try:
+        n = count()
+        sources = points(n)
+        facets = []
+        for i in range(count()):
+            k = count()
+            if pos + k > len(tokens):
+                raise ValueError("Solution is truncated")
+            facets.append([int(t) for t in tokens[pos : pos + k]])
+            pos += k
+        dests = points(n)
+    except IndexError:
+        raise ValueError("Solution is truncated")
+    if pos != len(tokens):
+        raise ValueError("Solution has trailing data")
+    for f in facets:
+        if len(f) < 3 or len(set(f)) != len(f):
+            raise ValueError("Bad facet " + " ".join(str(i) for i in f))
+        for i in f:
+            if i < 0 or i >= n:
+                raise ValueError("Facet refers to missing point " + str(i))
+    return sources, facets, dests
+
+def read_solution(filename):
+    with open(filename) as f:
+        return parse_solution(f.read())
+
+# Parsed problems, including the built skeleton, are cached here keyed by the
+# sha1 of the problem file. Set to None to disable the cache.
+cache_dir = "cache"
+
+# Bump whenever the format or the way the skeleton is built changes
+_cache_version = 3
+
+def _dumpq(x):
+    return (int(x.numerator), int(x.denominator))
+
+def _loadq(t):
+    return gmpy2.mpq(t[0], t[1])
+
+def _dumpxy(xy):
+    return _dumpq(xy[0]) + _dumpq(xy[1])
+
+def _loadxy(t):
+    return (gmpy2.mpq(t[0], t[1]), gmpy2.mpq(t[2], t[3]))
+
+# Serialises the problem as nested tuples of ints with marshal. For each
+# skeleton point we store its neighbours in anticlockwise order, together with
+# the index of the reverse edge and its length, or False if that is
+# irrational; each facet is its list of (point, edge) pairs and its interior
+# flag. Lengths are worked out here, so a cached problem never does it.
+def _dump_problem(problem):
+    s = problem.skeleton
+    pindex = {p : i for i, p in enumerate(s.points)}
+
+    points = []
+    for p in s.points:
+        edges = []
+        for e, q in p.edges:
+            length = e.rational
+            if length:
+                length = _dumpq(e._length)
+            edges.append((pindex[q], e.far[1], length))
+        points.append((_dumpxy(p.xy), tuple(edges)))
+
+    facets = []
+    for f in s.all_facets:
+        facets.append((f.interior, tuple((pindex[p], i) for p, i in f.points)))
+
+    polygons = tuple(tuple(_dumpxy(xy) for xy in polygon) for polygon in problem.polygons)
+    raw = tuple((_dumpxy(a), _dumpxy(b)) for a, b in problem.raw_skeleton)
+    return marshal.dumps((_cache_version, polygons, raw, tuple(points), tuple(facets)))
+
+def _load_problem(data):
+    version, polygons, raw, points_, facets_ = marshal.loads(data)
+    if version != _cache_version:
+        return None
 
+    polygons = [[_loadxy(xy) for xy in polygon] for polygon in polygons]
+    raw = [(_loadxy(a), _loadxy(b)) for a, b in raw]
+    return Problem(polygons, raw, functools.partial(_load_skeleton, points_, facets_))
+
+def _load_skeleton(points_, facets_):
+    points = [SkPoint(_loadxy(xy)) for xy, _ in points_]
+    for p, (_, edges) in zip(points, points_):
+        p.edges = []
+        for i, (k, _, length) in enumerate(edges):
+            e = SkEdge()
+            e.near = (p, i)
+            e._rational = length is not False
+            if e._rational:
+                e._length = _loadq(length)
+            p.edges.append((e, points[k]))
+        p.facets = [None] * len(edges)
+
+    for p, (_, edges) in zip(points, points_):
+        for (e, q), (_, j, _) in zip(p.edges, edges):
+            e.far = (q, j)
+
+    all_facets = []
+    for interior, fpoints in facets_:
+        f = SkFacet()
+        f.interior = interior
+        f.points = [(points[k], i) for k, i in fpoints]
+        for p, i in f.points:
+            p.facets[i] = f
+            p.edges[i][0].left = f
+        all_facets.append(f)
+    return Skeleton.fromparts(points, all_facets)
+
+# The skeleton is only built (or loaded from the cache) when first used, so
+# looking at the polygons, area or bounds is cheap
 class Problem:
-    def __init__(self, polygons, skeleton):
+    def __init__(self, polygons, skeleton, built = None):
         self.polygons = polygons
         self.raw_skeleton = skeleton
-        self.skeleton = Skeleton(polygons, skeleton)
+        self._edge_table = None
+        # A Skeleton, a function returning one, or None to build it
+        self._skeleton = built
+        # Where to save the problem once the skeleton is built
+        self._cache_path = None
+
+    @property
+    def skeleton(self):
+        if self._skeleton is None:
+            self._skeleton = Skeleton(self.polygons, self.raw_skeleton)
+            if self._cache_path is not None:
+                os.makedirs(cache_dir, exist_ok = True)
+                tmp = self._cache_path + "." + str(os.getpid())
+                with open(tmp, 'wb') as f:
+                    f.write(_dump_problem(self))
+                os.replace(tmp, self._cache_path)
+        elif not isinstance(self._skeleton, Skeleton):
+            self._skeleton = self._skeleton()
+        return self._skeleton
 
     def fromfile(filename):
-        with open(filename) as f:
-            polygons = []
-            n = int(f.readline())
-            for i in range(n):
-                k = int(f.readline())
-                polygon = []
-                for j in range(k):
-                    polygon.append(_readcoord(f.readline()))
-                polygons.append(polygon)
-
-            skeleton = []
-            n = int(f.readline())
-            for i in range(n):
-                a, b = f.readline().split()
-                skeleton.append((_readcoord(a), _readcoord(b)))
-
-        return Problem(polygons, skeleton)
+        with open(filename, 'rb') as f:
+            data = f.read()
+
+        if cache_dir is None:
+            return Problem(*_parse(data.decode()))
+
+        path = os.path.join(cache_dir, hashlib.sha1(data).hexdigest())
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                p = _load_problem(f.read())
+            if p is not None:
+                return p
+
+        p = Problem(*_parse(data.decode()))
+        p._cache_path = path
+        return p
+
+    # Maps each interior facet to a list with an entry for each of its edges:
+    # the reflection of the skeleton in that edge, and the facet reached by
+    # crossing it from an unflipped and from a flipped copy of the facet (None
+    # if that facet is not interior). Built on first use.
+    def edge_table(self):
+        if self._edge_table is None:
+            table = {}
+            for facet in self.skeleton.facets:
+                n = len(facet.points)
+                entries = []
+                for i in range(n):
+                    p, j = facet.points[i]
+                    q = facet.points[(i + 1) % n][0]
+                    m = len(p.facets)
+                    across = p.facets[(j + 1) % m]
+                    across_flipped = p.facets[(j - 1 + m) % m]
+                    entries.append((helper.Transform.flipedge(p.x, p.y, q.x, q.y),
+                        across if across.interior else None,
+                        across_flipped if across_flipped.interior else None))
+                table[facet] = entries
+            self._edge_table = table
+        return self._edge_table
+
+    # Returns (fingerprint, transform): fingerprint is the same for every
+    # problem that is this one moved by a rotation with rational cosine and
+    # sine, a translation and perhaps a reflection, and transform is the
+    # helper.Transform taking this problem to the standard position they
+    # share. Returns None if no skeleton edge has rational length.
+    def canonical(self):
+        edges = [e for point in self.skeleton.points for e, _ in point.edges if e.rational]
+        if len(edges) == 0:
+            return None
+        # Only the longest edges are lined up with the x-axis; each is tried
+        # in both directions, with and without a reflection. The polygons
+        # are compared first, being much smaller than the skeleton.
+        longest = max(e.length for e in edges)
+        candidates = []
+        for e in edges:
+            if e.length == longest:
+                for t in (helper.Transform.base(e), helper.Transform.baseflipped(e)):
+                    candidates.append((self._polygon_form(t), t))
+        least = min(form for form, _ in candidates)
+        best = None
+        for form, t in candidates:
+            if form == least:
+                segments = self._skeleton_form(t)
+                if best is None or segments < best[0]:
+                    best = (segments, t)
+        return hashlib.sha1(repr((least, best[0])).encode()).hexdigest(), best[1]
+
+    # The polygons moved by t, anticlockwise from their least point and marked
+    # with whether they were holes, in an order that doesn't depend on how
+    # they were listed
+    def _polygon_form(self, t):
+        polygons = []
+        for polygon, area in zip(self.polygons, self.areas()):
+            ps = [t.map(x, y) for x, y in polygon]
+            if t.flip:
+                ps.reverse()
+            i = ps.index(min(ps))
+            polygons.append((area < 0, tuple(ps[i:] + ps[:i])))
+        return tuple(sorted(polygons))
+
+    # The skeleton's segments moved by t, sorted
+    def _skeleton_form(self, t):
+        moved = {}
+        for point in self.skeleton.points:
+            moved[point] = t.map(point.x, point.y)
+        segments = set()
+        for point in self.skeleton.points:
+            a = moved[point]
+            for e, other in point.edges:
+                b = moved[other]
+                if a < b:
+                    segments.add((a, b))
+        return tuple(sorted(segments))
 
     def read_by_pid(pid):
         return Problem.fromfile("problems/" + str(pid))
@@ -270,10 +646,69 @@ class Problem:
             a_.append(a / 2)
         return a_
 
+    # Every skeleton point lies on a segment of the raw skeleton, so there is
+    # no need to build it
     def bounds(self):
         xs = []
         ys = []
-        for point in self.skeleton.points:
-            xs.append(point.x)
-            ys.append(point.y)
+        for a, b in self.raw_skeleton:
+            xs.extend((a[0], b[0]))
+            ys.extend((a[1], b[1]))
         return ((min(xs), max(xs)), (min(ys), max(ys)))
+
+# Returns what write_marshal saved in path, or default if there is nothing
+# there or it can't be read
+def read_marshal(path, default):
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            try:
+                return marshal.load(f)
+            except (EOFError, ValueError, TypeError):
+                pass
+    return default
+
+# Saves value with marshal, via a temporary file and rename so that readers
+# in other processes never see part of it
+def write_marshal(path, value):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+    tmp = path + "." + str(os.getpid())
+    with open(tmp, 'wb') as f:
+        marshal.dump(value, f)
+    os.replace(tmp, path)
+
+# Returns a dict from each pid to what Problem.canonical gives for it. The
+# results are remembered in cache_dir, keyed by the sha1 of the problem file,
+# so only new problems are loaded. hashes may give the sha1 of each pid's
+# file, saving reading it.
+def fingerprints(pids, dirname = "problems", hashes = None):
+    memo = {}
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, "fingerprints")
+        memo = read_marshal(path, {})
+
+    res = {}
+    changed = False
+    for pid in pids:
+        filename = os.path.join(dirname, str(pid))
+        if hashes is not None:
+            h = hashes[pid]
+        else:
+            with open(filename, 'rb') as f:
+                h = hashlib.sha1(f.read()).hexdigest()
+        if h not in memo:
+            c = Problem.fromfile(filename).canonical()
+            if c is not None:
+                fp, t = c
+                c = (fp, tuple(_dumpq(v) for v in (t.cos, t.sin, t.dx, t.dy)), t.flip)
+            memo[h] = c
+            changed = True
+        c = memo[h]
+        if c is not None:
+            fp, qs, flip = c
+            c = (fp, helper.Transform(*[_loadq(q) for q in qs], flip))
+        res[pid] = c
+
+    if changed and path is not None:
+        write_marshal(path, memo)
+    return res
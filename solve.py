@@ -1,65 +1,295 @@
 import os
 import os.path
+import io
 import time
-import random
+import json
+import cProfile
+import argparse
+import heapq
+import itertools
+import collections
+import multiprocessing
+import multiprocessing.connection
 
 import helper
 import sil
+import corpus
+import triage
 
 now = time.monotonic
 
+# Once a PartialSolution has more than grid_threshold boundary edges they are
+# indexed in a grid_size by grid_size grid; below that a plain scan is faster
+grid_size = 16
+grid_threshold = 48
+
+# Number of states remembered by the transposition table in solve()
+table_size = 1 << 16
+
+# Seconds a batch worker may overrun its time limit before it is killed
+kill_grace = 1
+
+# Each retry of a failed problem gets this many times the time it had before
+retry_growth = 2
+
+# Number of states kept at each step by the beam search
+beam_width = 64
+
+# The contest's limit on the size of a solution, not counting whitespace
+solution_size_limit = 5000
+
+# Lines of a solution joined into each write, and the file buffer size
+write_block = 256
+write_buffer = 1 << 16
+
+# Number of placed facets remembered by each FacetCache
+facet_cache_size = 1 << 14
+
+# Numbers edges in the order they are pushed on the heap, which breaks ties in
+# next_edge the same way for every representation of the open edges
+edge_counter = itertools.count()
+
 def priority(xy):
     return (2 * xy[0] - 1) ** 2 + (2 * xy[1] - 1) ** 2
 
+# Edge, SourceFacet and PartialSolution have __slots__, as a __dict__ would be
+# most of their size. Edges and facets are bounded by the FacetCache; what
+# grows with the search is the states and the structures they share.
 class Edge:
+    __slots__ = ("facet", "index", "a", "b", "ta", "tb", "midpoint", "fa", "fb", "fmidpoint",
+            "priority", "_cells")
+
     def __init__(self, facet, index):
         self.facet = facet
         self.index = index
         self.a = facet.points[index]
         self.b = facet.points[(index + 1) % facet.n]
-        self.ta = facet.transform_inv.map(self.a[0], self.a[1])
-        self.tb = facet.transform_inv.map(self.b[0], self.b[1])
+        # Where the ends lie in the skeleton; a facet's points are its
+        # target's moved, so these are the target's own tuples
+        self.ta = facet.target.points[index][0].xy
+        self.tb = facet.target.points[(index + 1) % facet.n][0].xy
         self.midpoint = ((self.a[0] + self.b[0]) / 2, (self.a[1] + self.b[1]) / 2)
-        self.priority = max(priority(self.a), priority(self.b))
+        # Floating point copies for the filtered predicates
+        self.fa = facet.fpoints[index]
+        self.fb = facet.fpoints[(index + 1) % facet.n]
+        self.fmidpoint = ((self.fa[0] + self.fb[0]) / 2, (self.fa[1] + self.fb[1]) / 2)
+        self.priority = max(facet.priorities[index], facet.priorities[(index + 1) % facet.n])
+        self._cells = None
+
+    def cells(self):
+        if self._cells is None:
+            self._cells = helper.segment_cells(self.a, self.b, grid_size)
+        return self._cells
+
+# A uniform grid over the unit square holding the edges that pass through each
+# cell, and through each row of cells. It is never modified in place: update
+# returns a new grid that shares every untouched row with the old one.
+class EdgeGrid:
+    __slots__ = ("cells", "rows")
+
+    def __init__(self, cells = None, rows = None):
+        if cells is None:
+            cells = (((),) * grid_size,) * grid_size
+            rows = ((),) * grid_size
+        self.cells = cells
+        self.rows = rows
+
+    def update(self, added, removed):
+        cells = list(self.cells)
+        rows = list(self.rows)
+        changed = {}
+        for e in added + removed:
+            for r, c in e.cells():
+                if r not in changed:
+                    changed[r] = list(cells[r])
+
+        for e in added:
+            for r in set(r for r, _ in e.cells()):
+                rows[r] = rows[r] + (e,)
+            for r, c in e.cells():
+                changed[r][c] = changed[r][c] + (e,)
+        for e in removed:
+            for r in set(r for r, _ in e.cells()):
+                rows[r] = tuple(e2 for e2 in rows[r] if e2 is not e)
+            for r, c in e.cells():
+                changed[r][c] = tuple(e2 for e2 in changed[r][c] if e2 is not e)
 
+        for r, row in changed.items():
+            cells[r] = tuple(row)
+        return EdgeGrid(tuple(cells), tuple(rows))
+
+    # All edges passing through any of the given cells
+    def near(self, cells):
+        es = set()
+        for r, c in cells:
+            es.update(self.cells[r][c])
+        return es
+
+    # All edges passing through the row of cells containing height y
+    def row(self, y):
+        return self.rows[helper._cell(y, grid_size)]
+
+# If shared is a dict, points equal to ones already in it are replaced by
+# those, so neighbouring facets hold one copy of the points they share and
+# of what is worked out from them
 class SourceFacet:
-    def __init__(self, target, transform):
+    __slots__ = ("target", "transform", "n", "points", "fpoints", "priorities", "area", "edges",
+            "_key", "_hash")
+
+    def __init__(self, target, transform, shared = None):
         self.target = target
         self.transform = transform
-        self.transform_inv = transform.inverse()
         self.n = len(target.points)
         self.points = []
+        self.fpoints = []
+        self.priorities = []
         for point, _ in target.points:
-            self.points.append(transform.map(point.x, point.y))
-        self.area = self.compute_area()
+            xy = transform.map(point.x, point.y)
+            if shared is not None and xy in shared:
+                xy, fxy, p = shared[xy]
+            else:
+                fxy = helper.fxy(xy)
+                p = priority(xy)
+                if shared is not None:
+                    shared[xy] = (xy, fxy, p)
+            self.points.append(xy)
+            self.fpoints.append(fxy)
+            self.priorities.append(p)
+        # Moving a facet doesn't change its area
+        self.area = target.size
+        self.edges = None
+        self._key = None
+        self._hash = None
 
+    # Identifies where the facet is placed
+    def key(self):
+        if self._key is None:
+            self._key = (self.target, self.transform.key())
+        return self._key
+
+    # Two independent 64 bit hashes of key(), as one 128 bit number
+    def state_hash(self):
+        if self._hash is None:
+            k = self.key()
+            self._hash = (hash(k) % (1 << 64)) | (hash((k, 1)) % (1 << 64)) << 64
+        return self._hash
+
+    # Returns a fresh list; the edges themselves are made once and shared
     def make_edges(self):
-        return [Edge(self, i) for i in range(self.n)]
+        if self.edges is None:
+            self.edges = [Edge(self, i) for i in range(self.n)]
+        return list(self.edges)
 
-    def compute_area(self):
-        a = 0
-        for i in range(self.n):
-            p = self.points[i]
-            q = self.points[(i + 1) % self.n]
-            a += p[0] * q[1] - p[1] * q[0]
-        return abs(a) / 2
+# Remembers the SourceFacet (and so its edges) made for each placement of a
+# target facet, so a candidate seen again is not rebuilt. Holds up to size
+# facets, dropping the least recently used. The facets' points are shared
+# through points, which maps each point to itself, its float copy and its
+# priority.
+class FacetCache:
+    def __init__(self, size = facet_cache_size):
+        self.size = size
+        self.facets = collections.OrderedDict()
+        self.points = {}
+        self.hits = 0
+        self.misses = 0
 
+    def get(self, target, transform):
+        key = (target, transform.key())
+        facet = self.facets.get(key)
+        if facet is not None:
+            self.hits += 1
+            self.facets.move_to_end(key)
+            return facet
+        self.misses += 1
+        facet = SourceFacet(target, transform, self.points)
+        self.facets[key] = facet
+        if len(self.facets) > self.size:
+            self.facets.popitem(last = False)
+        return facet
+
+def reject(rejected, reason):
+    if rejected is not None:
+        rejected[reason] += 1
+    return None
+
+# Immutable; the edge and facet collections are persistent structures, so a
+# child shares them with its parent and only pays for the facet it adds
 class PartialSolution:
-    def __init__(self, problem):
-        self.closed_edges = []
-        self.open_edges = []
-        self.facets = []
+    __slots__ = ("closed_edges", "open_edges", "facets", "problem", "area", "targetted_facets",
+            "uncovered", "uncovered_area", "grid", "heap", "endpoints", "key", "cache")
+
+    def __init__(self, problem, cache = None):
+        self.closed_edges = helper.Chain()
+        self.open_edges = helper.BucketSet()
+        self.facets = helper.Chain()
         self.problem = problem
         self.area = 0
-        self.targetted_facets = set()
+        # Bit i is set if facets[i] of the skeleton has been placed
+        self.targetted_facets = 0
+        # Number and total area of the target facets not placed yet
+        self.uncovered = len(problem.skeleton.facets)
+        self.uncovered_area = problem.skeleton.total_size
+        # Holds closed_edges + open_edges, or None if there are only a few
+        self.grid = None
+        # The open edges keyed on priority; may also hold edges no longer open
+        self.heap = None
+        # Maps each point to the open edges ending there
+        self.endpoints = helper.BucketMap()
+        # 128 bit hash of the set of placed facets, which determines the whole
+        # state
+        self.key = 0
+        # Shared by every state of one search
+        if cache is None:
+            cache = FacetCache()
+        self.cache = cache
+
+    def edges_near(self, e):
+        if self.grid is None:
+            return self.open_edges
+        return self.grid.near(e.cells())
+
+    def edges_in_row(self, y):
+        if self.grid is None:
+            return itertools.chain(self.closed_edges, self.open_edges)
+        return self.grid.row(y)
 
     def next_edge(self):
-        return max(self.open_edges, key = lambda e : e.priority)
+        # Dropping closed edges from the top of the heap doesn't change the
+        # solution, just saves doing it again
+        while self.heap[2] not in self.open_edges:
+            self.heap = helper.heap_pop(self.heap)
+        return self.heap[2]
 
-    def in_interior(self, xy):
+    def edges_touching(self, e):
+        es = self.endpoints.get(e.a, ())
+        for e2 in self.endpoints.get(e.b, ()):
+            if e2 not in es:
+                es = es + (e2,)
+        return es
+
+    # fxy is xy in floating point, if known
+    def in_interior(self, xy, fxy = None):
         interior = False
         x, y = xy
-        for e in self.closed_edges + self.open_edges:
+        if fxy is None:
+            fxy = helper.fxy(xy)
+        fx, fy = fxy
+        eps = helper.orient_error
+        for e in self.edges_in_row(y):
+            # Settle the usual cases in floating point: the edge is
+            # certainly above or below the ray, or certainly crosses its line
+            dy1 = e.fa[1] - fy
+            dy2 = e.fb[1] - fy
+            if (dy1 > eps and dy2 > eps) or (dy1 < -eps and dy2 < -eps):
+                continue
+            if (dy1 > eps and dy2 < -eps) or (dy1 < -eps and dy2 > eps):
+                # The crossing is right of the point iff this has the sign of dy2
+                o = helper._orient(e.fa, e.fb, (fx, fy))
+                if o > eps or o < -eps:
+                    if (o > 0) == (dy2 > 0):
+                        interior = not interior
+                    continue
+
             x1, y1 = e.a
             x2, y2 = e.b
             ys = (y1 - y) * (y2 - y)
@@ -77,84 +307,117 @@ class PartialSolution:
         return self.area == 1
 
     # Returns a new PartialSolution, does not modify the existing one
-    # Returns None if it doesn't work
-    def extend_if_possible(self, facet):
+    # Returns None if it doesn't work, counting why in rejected if given
+    def extend_if_possible(self, facet, rejected = None):
         # print("Extending...")
         # Check if any part of the new facet leaves the box
         for x, y in facet.points:
             if x < 0 or x > 1 or y < 0 or y > 1:
-                return None
+                return reject(rejected, "out_of_box")
 
         # Remove any edges that lie on the boundary
-        new = PartialSolution(self.problem)
-        new.closed_edges = list(self.closed_edges)
-        new.open_edges = list(self.open_edges)
-        new.facets = list(self.facets)
         fe = facet.make_edges()
+        closed = []
+        matched = []
 
         for e in list(fe):
             m = e.midpoint
             if m[0] == 0 or m[0] == 1 or m[1] == 0 or m[1] == 1:
                 fe.remove(e)
-                new.closed_edges.append(e)
+                closed.append(e)
 
         # Check if any edge of the new facet has an interior inside the existing solution
         for e in fe:
-            if self.in_interior(e.midpoint):
-                return None
+            if self.in_interior(e.midpoint, e.fmidpoint):
+                return reject(rejected, "interior_overlap")
 
-        # Check if any edge of the new facet intersects badly the existing solution
+        # Check if any edge of the new facet intersects badly the existing solution.
+        # Closed edges are on the boundary of the box, so can never cross a new edge
         for e in fe:
-            for e2 in self.open_edges:
-                if helper.intersect(e.a, e.b, e2.a, e2.b):
-                    return None
+            for e2 in self.edges_near(e):
+                if helper.intersect_filtered(e.a, e.b, e2.a, e2.b, e.fa, e.fb, e2.fa, e2.fb):
+                    return reject(rejected, "edge_crossing")
 
         # For each intersection check if the transforms are consistent, and remove any
         # finished edges
 
         for e in list(fe):
-            for e2 in self.open_edges:
+            for e2 in self.edges_touching(e):
                 if e.a == e2.a:
                     if e.ta != e2.ta:
-                        return None
+                        return reject(rejected, "transform_mismatch")
                 if e.a == e2.b:
                     if e.ta != e2.tb:
-                        return None
+                        return reject(rejected, "transform_mismatch")
                 if e.b == e2.a:
                     if e.tb != e2.ta:
-                        return None
+                        return reject(rejected, "transform_mismatch")
                 if e.b == e2.b:
                     if e.tb != e2.tb:
-                        return None
+                        return reject(rejected, "transform_mismatch")
                 if (e.a == e2.a and e.b == e2.b) or (e.a == e2.b and e.b == e2.a):
-                    new.open_edges.remove(e2)
                     fe.remove(e)
+                    matched.append(e2)
 
-        # Add edges to existing lists
-        new.open_edges.extend(fe)
-        new.facets.append(facet)
-        new.targetted_facets = set(self.targetted_facets)
-        new.targetted_facets.add(facet.target)
-        new.area = self.area + facet.area
-
-        if new.area > 1:
+        area = self.area + facet.area
+        if area > 1:
             # This really shouldn't be necessary :(
-            print ("G")
-            return None
+            return reject(rejected, "area_overflow")
+
+        uncovered = self.uncovered
+        uncovered_area = self.uncovered_area
+        if not (self.targetted_facets >> facet.target.index) & 1:
+            uncovered -= 1
+            uncovered_area -= facet.area
+        num_open = len(self.open_edges) + len(fe) - len(matched)
 
         # Are we done?
-        if new.is_done():
+        if area == 1:
             # Check that there are not any unmatched edges
-            if len(new.open_edges) > 0:
-                # print("Extra edges")
-                return None
+            if num_open > 0:
+                return reject(rejected, "extra_edges")
             # we also need to check if there are any target facets we never used
-            for tf in self.problem.skeleton.facets:
-                if tf not in new.targetted_facets:
-                    # print(len(new.targetted_facets))
-                    # print(len(self.problem.skeleton.facets))
-                    # print("Missing facets")
-                    return None
+            if uncovered > 0:
+                return reject(rejected, "missing_facets")
+        else:
+            # Each unused target facet must still be placed somewhere, and the
+            # open edges need at least one more facet, so the rest of the
+            # square must have room for them
+            needed = uncovered_area
+            if num_open > 0:
+                needed = max(needed, self.problem.skeleton.min_size)
+            if area + needed > 1:
+                return reject(rejected, "area_bound")
+
+        # Add edges to the new solution, sharing everything else with this one
+        new = PartialSolution(self.problem, self.cache)
+        new.closed_edges = self.closed_edges.extend(closed)
+        new.open_edges = self.open_edges.update(fe, matched)
+        new.heap = self.heap
+        for e in fe:
+            new.heap = helper.heap_push(new.heap, (-e.priority, next(edge_counter)), e)
+        ends = {}
+        for e in matched + fe:
+            for xy in (e.a, e.b):
+                if xy not in ends:
+                    ends[xy] = self.endpoints.get(xy, ())
+        for e in matched:
+            for xy in (e.a, e.b):
+                ends[xy] = tuple(e2 for e2 in ends[xy] if e2 is not e)
+        for e in fe:
+            for xy in (e.a, e.b):
+                ends[xy] = ends[xy] + (e,)
+        new.endpoints = self.endpoints.update({xy : es or None for xy, es in ends.items()})
+        if self.grid is not None:
+            new.grid = self.grid.update(closed + fe, matched)
+        elif len(new.closed_edges) + len(new.open_edges) > grid_threshold:
+            new.grid = EdgeGrid().update(list(new.closed_edges) + list(new.open_edges), [])
+        new.facets = self.facets.append(facet)
+        new.targetted_facets = self.targetted_facets | (1 << facet.target.index)
+        new.uncovered = uncovered
+        new.uncovered_area = uncovered_area
+        new.area = area
+        new.key = (self.key + facet.state_hash()) % (1 << 128)
 
         # print("    Successful")
         return new
@@ -163,20 +426,16 @@ class PartialSolution:
         edge = self.next_edge()
 
         f = edge.facet
-        i = edge.index
         t = f.transform
+        reflection, across, across_flipped = self.problem.edge_table()[f.target][edge.index]
 
-        t1 = t.compose(helper.Transform.flipedge(edge.a[0], edge.a[1], edge.b[0], edge.b[1]))
-        f1 = SourceFacet(f.target, t1)
-
-        p, j = f.target.points[i]
-        if t.flip:
-            tf = p.facets[(j - 1 + len(p.facets)) % len(p.facets)]
-        else:
-            tf = p.facets[(j + 1) % len(p.facets)]
+        # Reflecting in the placed edge is the same as reflecting the skeleton
+        # in the edge before placing it
+        f1 = self.cache.get(f.target, reflection.compose(t))
 
-        if tf.interior:
-            f2 = SourceFacet(tf, t)
+        tf = across_flipped if t.flip else across
+        if tf is not None:
+            f2 = self.cache.get(tf, t)
             return [f1, f2]
         else:
             return [f1]
@@ -189,82 +448,325 @@ class PartialSolution:
                     if e.left.interior:
                         t = helper.Transform.base(e)
                         t = helper.Transform.baseflipped(e)
-                        facets.append(SourceFacet(e.left, helper.Transform.base(e)))
-                        facets.append(SourceFacet(e.left, helper.Transform.baseflipped(e)))
+                        facets.append(self.cache.get(e.left, helper.Transform.base(e)))
+                        facets.append(self.cache.get(e.left, helper.Transform.baseflipped(e)))
         return facets
 
-    def print_solution(self, filename):
-        points = set()
-        for facet in self.facets:
-            n = len(facet.points)
-            for i in range(n):
-                p = facet.points[i]
-                points.add((p, facet.transform_inv.map(p[0], p[1])))
-        points = list(points)
-
+    # The source points in the order first used, the facets as lists of
+    # indices into them, and the destination of each point
+    def solution_parts(self):
+        index = {}
+        sources = []
+        dests = []
         fs = []
         for facet in self.facets:
             f = []
-            for p in facet.points:
-                for i, q in enumerate(points):
-                    if p == q[0]:
-                        f.append(i)
-                        break
+            for p, (q, _) in zip(facet.points, facet.target.points):
+                k = index.get(p)
+                if k is None:
+                    k = len(sources)
+                    index[p] = k
+                    sources.append(p)
+                    dests.append(q.xy)
+                f.append(k)
             fs.append(f)
+        return sources, fs, dests
 
-        with open(filename, 'w') as f_:
-            f_.write(str(len(points)))
-            f_.write('\n')
-            for point, _ in points:
-                f_.write(str(point[0]) + ',' + str(point[1]))
-                f_.write('\n')
-            f_.write(str(len(fs)))
-            f_.write('\n')
-            for f in fs:
-                f_.write(str(len(f)))
-                for i in f:
-                    f_.write(' ')
-                    f_.write(str(i))
-                f_.write('\n')
-            for _, point in points:
-                f_.write(str(point[0]) + ',' + str(point[1]))
-                f_.write('\n')
-
-def solve(problem, timelimit = 5):
-    start = now()
+    def solution_string(self, check = True):
+        out = io.StringIO()
+        write_solution(out, *self.solution_parts(), check = check)
+        return out.getvalue()
+
+    def print_solution(self, filename, check = True):
+        with open(filename, 'w', buffering = write_buffer) as f:
+            write_solution(f, *self.solution_parts(), check = check)
+
+# Raises ValueError if the contest would reject the solution: a point outside
+# the unit square or given twice, a degenerate facet, or more than
+# solution_size_limit characters other than whitespace. coords are the
+# formatted source and destination points.
+def check_solution(sources, fs, coords):
+    if len(set(sources)) != len(sources):
+        raise ValueError("Solution has repeated source points")
+    for x, y in sources:
+        if x < 0 or x > 1 or y < 0 or y > 1:
+            raise ValueError("Solution has a point outside the unit square")
+    for f in fs:
+        if len(f) < 3 or len(set(f)) != len(f):
+            raise ValueError("Solution has a degenerate facet")
+
+    size = len(str(len(sources))) + len(str(len(fs))) + sum(len(c) for c in coords)
+    for f in fs:
+        size += len(str(len(f))) + sum(len(str(k)) for k in f)
+    check_size(size)
+
+# Raises ValueError if a solution with size characters other than whitespace
+# is too big for the contest
+def check_size(size):
+    if size > solution_size_limit:
+        raise ValueError("Solution has size " + str(size) + ", over the limit of " +
+                str(solution_size_limit))
 
-    stack = []
-    ps = PartialSolution(problem)
+# Writes a solution in the contest format to the file f. Each number is
+# formatted once, and lines are written a block at a time.
+def write_solution(f, sources, fs, dests, check = True):
+    coords = [str(x) + ',' + str(y) for x, y in sources]
+    coords.extend(str(x) + ',' + str(y) for x, y in dests)
+    if check:
+        check_solution(sources, fs, coords)
+
+    lines = [str(len(sources))]
+    lines.extend(coords[:len(sources)])
+    lines.append(str(len(fs)))
+    for fc in fs:
+        lines.append(' '.join([str(len(fc))] + [str(k) for k in fc]))
+    lines.extend(coords[len(sources):])
+    for k in range(0, len(lines), write_block):
+        f.write('\n'.join(lines[k : k + write_block]) + '\n')
+
+# Remembers the most recently expanded states, so that a state reached again
+# by placing the same facets in a different order is not expanded twice. Only
+# each state's key is kept; at 128 bits two different states sharing one is
+# far less likely than the search finishing.
+class TranspositionTable:
+    def __init__(self, size = table_size):
+        self.size = size
+        self.states = collections.OrderedDict()
+
+    # Returns whether an identical state was already seen, and remembers ps
+    def seen(self, ps):
+        if ps.key in self.states:
+            self.states.move_to_end(ps.key)
+            return True
+        self.states[ps.key] = None
+        if len(self.states) > self.size:
+            self.states.popitem(last = False)
+        return False
+
+# Counters kept by the searches
+class SearchStats:
+    def __init__(self):
+        self.expanded = 0
+        self.pruned = 0
+        # Candidate facets that were placed, and those rejected by reason
+        self.generated = 0
+        self.rejected = collections.Counter()
+        self.peak_frontier = 0
+        self.max_depth = 0
+        # Shared by every state of the search, so its hits and misses can be
+        # reported
+        self.cache = FacetCache()
+
+    def expand(self, ps):
+        self.expanded += 1
+        self.max_depth = max(self.max_depth, len(ps.facets))
+
+    def frontier(self, n):
+        self.peak_frontier = max(self.peak_frontier, n)
+
+    def extend(self, ps, facet):
+        ps_ = ps.extend_if_possible(facet, self.rejected)
+        if ps_ is not None:
+            self.generated += 1
+        return ps_
+
+    def todict(self):
+        return {
+                "expanded" : self.expanded,
+                "pruned" : self.pruned,
+                "generated" : self.generated,
+                "branching" : self.generated / max(self.expanded, 1),
+                "rejected" : dict(self.rejected),
+                "peak_frontier" : self.peak_frontier,
+                "max_depth" : self.max_depth,
+                "cache_hits" : self.cache.hits,
+                "cache_misses" : self.cache.misses
+                }
+
+def starting_states(problem, counts):
+    ps = PartialSolution(problem, counts.cache)
+    states = []
     for facet in ps.candidate_starting_facets():
-        ps_ = ps.extend_if_possible(facet)
+        ps_ = counts.extend(ps, facet)
+        if ps_ is not None:
+            states.append(ps_)
+    return states
+
+def children(ps, counts):
+    states = []
+    for f in ps.candidate_new_facets():
+        ps_ = counts.extend(ps, f)
         if ps_ is not None:
-            stack.append(ps_)
+            states.append(ps_)
+    return states
+
+def out_of_time(deadline):
+    return deadline is not None and now() > deadline
+
+# Each search returns a finished PartialSolution, -1 if it ran out of time, or
+# None if it gave up, and records what it did in counts, a SearchStats.
+
+def search_dfs(problem, deadline, counts):
+    table = TranspositionTable()
+    stack = starting_states(problem, counts)
 
     while len(stack) > 0:
         ps = stack.pop()
         # print(len(stack), ps.area, len(ps.facets), len(ps.open_edges))
-        # for oe in ps.open_edges:
-            # print("    ", oe.a, oe.b)
 
         if ps.is_done():
             return ps
 
+        # Every state pushed after an identical one has been fully explored
+        # by the time the older one is popped, so skipping it loses nothing
+        if table.seen(ps):
+            counts.pruned += 1
+            continue
+        counts.expand(ps)
+
         fs = ps.candidate_new_facets()
 
-        if len(fs) > 1:
-            cur = now()
-            if cur - start > timelimit:
-                return -1
+        if len(fs) > 1 and out_of_time(deadline):
+            return -1
 
         for f in fs:
-            ps_ = ps.extend_if_possible(f)
+            ps_ = counts.extend(ps, f)
             if ps_ is not None:
                 stack.append(ps_)
+        counts.frontier(len(stack))
     return None
 
+# Always expands the state covering the most area, the deepest on ties
+def search_best_first(problem, deadline, counts):
+    table = TranspositionTable()
+    order = itertools.count()
+    heap = []
+    for ps in starting_states(problem, counts):
+        heapq.heappush(heap, (-ps.area, -next(order), ps))
+
+    while len(heap) > 0:
+        ps = heapq.heappop(heap)[2]
+        if ps.is_done():
+            return ps
+        # The children of an identical state are already in the heap
+        if table.seen(ps):
+            counts.pruned += 1
+            continue
+        counts.expand(ps)
+        if out_of_time(deadline):
+            return -1
+
+        for ps_ in children(ps, counts):
+            heapq.heappush(heap, (-ps_.area, -next(order), ps_))
+        counts.frontier(len(heap))
+    return None
+
+# Expands the states one facet at a time, keeping only the width covering the
+# most area at each step. Giving up does not mean there is no solution.
+def search_beam(problem, deadline, counts, width = None):
+    if width is None:
+        width = beam_width
+
+    level = starting_states(problem, counts)
+    while len(level) > 0:
+        level.sort(key = lambda ps : ps.area, reverse = True)
+        table = TranspositionTable()
+        kept = 0
+        next_level = []
+        for ps in level:
+            if kept == width:
+                break
+            if ps.is_done():
+                return ps
+            if table.seen(ps):
+                counts.pruned += 1
+                continue
+            kept += 1
+            counts.expand(ps)
+            if out_of_time(deadline):
+                return -1
+            next_level.extend(children(ps, counts))
+        level = next_level
+        counts.frontier(len(level))
+    return None
+
+# Depth first search placing at most limit facets, with limit starting at the
+# number of facets of the skeleton (each is used at least once) and growing
+# by one until the search finishes without hitting it
+def search_iddfs(problem, deadline, counts):
+    starts = starting_states(problem, counts)
+    limit = len(problem.skeleton.facets)
+
+    while True:
+        table = TranspositionTable()
+        stack = list(starts)
+        cut = False
+        while len(stack) > 0:
+            ps = stack.pop()
+            if ps.is_done():
+                return ps
+            if len(ps.facets) >= limit:
+                cut = True
+                continue
+            # Identical states are at the same depth, so this is safe as in dfs
+            if table.seen(ps):
+                counts.pruned += 1
+                continue
+            counts.expand(ps)
+            if out_of_time(deadline):
+                return -1
+            stack.extend(children(ps, counts))
+            counts.frontier(len(stack))
+        if not cut:
+            return None
+        limit += 1
+
+strategies = {
+        "dfs" : search_dfs,
+        "best" : search_best_first,
+        "beam" : search_beam,
+        "iddfs" : search_iddfs
+        }
+
+# Strategies for which returning None proves there is no solution
+complete_strategies = {"dfs", "best", "iddfs"}
+
+# If stats is a dict, it is filled in with the search time and the counters
+# from SearchStats
+def solve(problem, timelimit = 5, stats = None, strategy = "dfs", width = None):
+    start = now()
+    deadline = None if timelimit is None else start + timelimit
+    counts = SearchStats()
+    if strategy == "beam":
+        ps = search_beam(problem, deadline, counts, width)
+    else:
+        ps = strategies[strategy](problem, deadline, counts)
+
+    if stats is not None:
+        stats.update(counts.todict())
+        stats["search_time"] = now() - start
+    return ps
+
+# Solutions from approx.py are marked by a file of the same name here; they
+# don't count as solving the problem, and are replaced by exact ones
+approx_dir = "approx"
+
+def listdir(dirname):
+    if not os.path.isdir(dirname):
+        return []
+    return os.listdir(dirname)
+
+# Names of problems with an exact solution
+def solved_names():
+    return set(os.listdir("solutions")) - set(listdir(approx_dir))
+
+def has_solution(pid):
+    return (os.path.isfile("solutions/" + str(pid)) and
+            not os.path.isfile(os.path.join(approx_dir, str(pid))))
+
 def unsolved_pids():
-    xs = os.listdir("problems")
-    ys = set(os.listdir("solutions"))
+    xs = [x for x in os.listdir("problems") if x.isdigit()]
+    ys = solved_names()
     zs = set(os.listdir("failed"))
 
     res = []
@@ -273,21 +775,314 @@ def unsolved_pids():
             res.append(int(x))
     return sorted(res)
 
-if __name__ == "__main__":
-    pids = unsolved_pids()
-    random.shuffle(pids)
+# A file in failed/ holding this marks a problem shown to have no solution
+# (that the search can find), which is never worth retrying
+proven_failure = "none"
+
+def is_proven_failure(pid):
+    try:
+        with open("failed/" + str(pid)) as f:
+            return f.read() == proven_failure
+    except OSError:
+        return False
+
+def failed_pids():
+    ys = solved_names()
+    return sorted(int(x) for x in os.listdir("failed")
+            if x.isdigit() and x not in ys and not is_proven_failure(x))
+
+# Seconds the last failed attempt at pid was given, or None if not known
+def failed_budget(pid):
+    try:
+        with open("failed/" + str(pid)) as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        return None
+
+# With retry, problems that previously failed are attempted again
+def is_done(pid, retry = False):
+    if has_solution(pid):
+        return True
+    return not retry and os.path.isfile("failed/" + str(pid))
+
+# Write via a hidden temporary file and rename, so an interrupted run never
+# leaves a truncated file behind
+def write_atomic(path, text):
+    d, name = os.path.split(path)
+    tmp = os.path.join(d, "." + name + ".tmp")
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+# A failure is marked by a file in failed/ holding the seconds the search had,
+# if budget gives them, or proven_failure if proven says a complete search
+# found there is no solution
+def record_result(pid, x, stats = None, budget = None, proven = False):
+    if stats is not None:
+        print ("Problem " + str(pid) + ": " + stats["strategy"] + " expanded " +
+                str(stats["expanded"]) + ", skipped " + str(stats["pruned"]) + " repeated states")
+    failure = "" if budget is None else str(budget)
+    if x == -1:
+        print ("Problem " + str(pid) + ": Out of time")
+        write_atomic("failed/" + str(pid), failure)
+    elif x is None and proven:
+        print ("Problem " + str(pid) + ": No solution")
+        write_atomic("failed/" + str(pid), proven_failure)
+    elif x is None:
+        print ("Problem " + str(pid) + ": No solution???")
+        write_atomic("failed/" + str(pid), failure)
+    else:
+        print ("Problem " + str(pid) + ": Success!")
+        write_atomic("solutions/" + str(pid), x)
+        if os.path.isfile("failed/" + str(pid)):
+            os.remove("failed/" + str(pid))
+        # An approximate solution was replaced, so the new one needs submitting
+        if os.path.isfile(os.path.join(approx_dir, str(pid))):
+            os.remove(os.path.join(approx_dir, str(pid)))
+            if os.path.isfile("submitted/" + str(pid)):
+                os.remove("submitted/" + str(pid))
+
+# Groups problems that are congruent by a rigid motion that helper.Transform
+# can represent (which includes identical problems). Returns a list of lists
+# of pids, in the order their first members appear in pids, and a dict from
+# each pid to the Transform taking it to the standard position of its group.
+def congruent_groups(pids):
+    index = corpus.load()
+    prints = sil.fingerprints(pids, hashes = {pid : index[pid]["hash"] for pid in pids})
+    groups = {}
+    transforms = {}
     for pid in pids:
-        if os.path.isfile("solutions/" + str(pid)) or os.path.isfile("failed/" + str(pid)):
-            continue
+        c = prints[pid]
+        if c is None:
+            groups[pid] = [pid]
+        else:
+            groups.setdefault(c[0], []).append(pid)
+            transforms[pid] = c[1]
+    return list(groups.values()), transforms
+
+# Moves a solution of one problem onto a congruent one, given the transforms
+# taking each of them to their shared standard position. Raises ValueError if
+# the moved solution is too big, as its coordinates may be longer.
+def move_solution(text, t_from, t_to):
+    sources, fs, dests = sil.parse_solution(text)
+    t = t_from.compose(t_to.inverse())
+    out = io.StringIO()
+    write_solution(out, sources, fs, [t.map(x, y) for x, y in dests])
+    return out.getvalue()
 
-        print ("Solving problem " + str(pid))
-        x = solve(sil.Problem.read_by_pid(pid))
-        if x == -1:
-            print ("Out of time")
-            open("failed/" + str(pid), 'a')
-        elif x is None:
-            print ("No solution???")
-            open("failed/" + str(pid), 'a')
+# Records the solution text of a problem, moved onto the congruent problem
+# pid, or a failure for pid if the moved solution is no good
+def record_moved(pid, text, t_from, t_to):
+    try:
+        x = move_solution(text, t_from, t_to)
+    except ValueError as e:
+        print ("Problem " + str(pid) + ": " + str(e))
+        write_atomic("failed/" + str(pid), "")
+        return
+    record_result(pid, x)
+
+# Writes the result of solving pid, which may be a solution string, for pid
+# and for each congruent problem in others
+def record_congruent(pid, x, stats, others, transforms, budget = None, proven = False):
+    record_result(pid, x, stats, budget, proven)
+    for q in others:
+        if x is None or x == -1:
+            record_result(q, x, budget = budget, proven = proven)
         else:
-            print ("Success!")
-            x.print_solution("solutions/" + str(pid))
+            record_moved(q, x, transforms[pid], transforms[q])
+
+# Gives each unsolved problem that is congruent to a solved one the moved
+# solution
+def share_solutions():
+    pids = [int(x) for x in os.listdir("problems") if x.isdigit()]
+    groups, transforms = congruent_groups(pids)
+    for group in groups:
+        solved = [pid for pid in group if has_solution(pid)]
+        if len(solved) == 0 or len(solved) == len(group):
+            continue
+        with open("solutions/" + str(solved[0])) as f:
+            text = f.read()
+        for pid in group:
+            if pid not in solved:
+                print ("Problem " + str(pid) + ": congruent to " + str(solved[0]))
+                record_moved(pid, text, transforms[solved[0]], transforms[pid])
+
+# Appends one JSON line per finished search
+def write_metrics(filename, pid, strategy, x, stats):
+    if x == -1:
+        result = "timeout"
+    elif x is None:
+        result = "none" if stats is not None else "died"
+    else:
+        result = "solved"
+    record = {"pid" : pid, "strategy" : strategy, "result" : result}
+    if stats is not None:
+        record.update(stats)
+    with open(filename, 'a') as f:
+        f.write(json.dumps(record, sort_keys = True) + '\n')
+
+# Runs in a child process. The search stops itself at the time limit so that
+# its statistics can be sent back; the parent kills us if that doesn't happen.
+# With profile_dir, a cProfile dump of the run is written there.
+def _solve_worker(pid, strategy, width, timelimit, profile_dir, conn):
+    if profile_dir is not None:
+        profile = cProfile.Profile()
+        profile.enable()
+
+    start = now()
+    p = sil.Problem.read_by_pid(pid)
+    stats = {"strategy" : strategy, "load_time" : now() - start}
+    # Building or unpacking the skeleton is timed apart from the search
+    mid = now()
+    p.skeleton
+    stats["skeleton_time"] = now() - mid
+    x = solve(p, max(0, timelimit - (now() - start)), stats, strategy, width)
+    if x is not None and x != -1:
+        try:
+            x = x.solution_string()
+        except ValueError as e:
+            print ("Problem " + str(pid) + ": " + str(e))
+            stats["bad_solution"] = str(e)
+            x = None
+
+    if profile_dir is not None:
+        profile.disable()
+        profile.dump_stats(os.path.join(profile_dir, str(pid) + "." + strategy + ".prof"))
+
+    conn.send((x, stats))
+    conn.close()
+
+# Solves the given problems in parallel, one process per problem and strategy.
+# With several strategies (a portfolio) they all run at once on each problem,
+# the first success wins and the others are killed; each gets an equal share
+# of timelimit. Anything still running kill_grace seconds after its deadline
+# is killed and counts as out of time. All files are written by the parent, so
+# the run can be interrupted and resumed. Per-search statistics are appended
+# to metrics unless it is None. Congruent problems are solved once and the
+# result is recorded for all of them. Problems triage.py shows can't be
+# solved are failed without a search, and the rest run in order of their
+# predicted cost, cheapest first. With retry, each problem gets retry_growth
+# times the time its last attempt had, or timelimit if that is more.
+def solve_batch(pids, timelimit = 5, jobs = None, portfolio = ("dfs",), width = None, retry = False,
+        metrics = "metrics.jsonl", profile_dir = None):
+    if jobs is None:
+        jobs = os.cpu_count()
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok = True)
+    share_solutions()
+    pids = [pid for pid in pids if not is_done(pid, retry)]
+    groups, transforms = congruent_groups(pids)
+    copies = {}
+    for group in groups:
+        copies[group[0]] = group[1:]
+    pids, rejected = triage.triage([pid for pid in pids if pid in copies])
+    for pid, reason in rejected.items():
+        print ("Problem " + str(pid) + ": Infeasible, " + reason)
+        for q in [pid] + copies[pid]:
+            write_atomic("failed/" + str(q), proven_failure)
+
+    budgets = {}
+    for pid in pids:
+        budgets[pid] = timelimit
+        if retry and failed_budget(pid) is not None:
+            budgets[pid] = max(timelimit, retry_growth * failed_budget(pid))
+    pending = [(pid, strategy) for pid in reversed(pids) for strategy in reversed(portfolio)]
+    running = {}
+    # For each problem being worked on, the results of its strategies so far
+    results = {}
+
+    def stop(pid):
+        for task in list(running):
+            if task[0] == pid:
+                proc, recv, _ = running.pop(task)
+                proc.terminate()
+                proc.join()
+                recv.close()
+        del results[pid]
+
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < jobs:
+                pid, strategy = pending.pop()
+                if pid not in results:
+                    if is_done(pid, retry) or strategy != portfolio[0]:
+                        continue
+                    results[pid] = []
+                budget = budgets[pid] / len(portfolio)
+                recv, send = multiprocessing.Pipe(False)
+                proc = multiprocessing.Process(target = _solve_worker,
+                        args = (pid, strategy, width, budget, profile_dir, send))
+                proc.start()
+                send.close()
+                running[(pid, strategy)] = (proc, recv, now() + budget + kill_grace)
+
+            if len(running) == 0:
+                continue
+
+            wait = max(0, min(d for _, _, d in running.values()) - now())
+            ready = multiprocessing.connection.wait([r for _, r, _ in running.values()], wait)
+
+            for (pid, strategy), (proc, recv, deadline) in list(running.items()):
+                if (pid, strategy) not in running:
+                    continue
+                if recv in ready:
+                    try:
+                        x, stats = recv.recv()
+                    except EOFError:
+                        print ("Problem " + str(pid) + ": Worker died")
+                        x, stats = None, None
+                elif now() > deadline:
+                    proc.terminate()
+                    x, stats = -1, None
+                else:
+                    continue
+                proc.join()
+                recv.close()
+                del running[(pid, strategy)]
+                results[pid].append(x)
+                if metrics is not None:
+                    write_metrics(metrics, pid, strategy, x, stats)
+
+                proven = (x is None and stats is not None and strategy in complete_strategies and
+                        "bad_solution" not in stats)
+                if (x is not None and x != -1) or proven:
+                    record_congruent(pid, x, stats, copies[pid], transforms, budgets[pid], proven)
+                    stop(pid)
+                elif len(results[pid]) == len(portfolio):
+                    record_congruent(pid, -1 if -1 in results[pid] else None, stats,
+                            copies[pid], transforms, budgets[pid])
+                    stop(pid)
+    finally:
+        for proc, recv, _ in running.values():
+            proc.terminate()
+            proc.join()
+            recv.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jobs", type = int, default = None)
+    parser.add_argument("-t", "--timelimit", type = float, default = 5,
+            help = "seconds per problem, shared between the strategies")
+    parser.add_argument("-s", "--strategy", action = "append", choices = sorted(strategies),
+            help = "search strategy; give several to run them as a portfolio")
+    parser.add_argument("--portfolio", action = "store_true", help = "run every strategy")
+    parser.add_argument("--beam-width", type = int, default = beam_width)
+    parser.add_argument("--retry", action = "store_true",
+            help = "retry the problems in failed/, with more time than before")
+    parser.add_argument("--metrics", default = "metrics.jsonl",
+            help = "file to append per-problem statistics to")
+    parser.add_argument("--profile", metavar = "DIR", default = None,
+            help = "write a cProfile dump for every search to DIR")
+    args = parser.parse_args()
+
+    if args.portfolio:
+        portfolio = sorted(strategies)
+    else:
+        portfolio = args.strategy or ["dfs"]
+
+    if args.retry:
+        pids = failed_pids()
+    else:
+        pids = unsolved_pids()
+    solve_batch(pids, args.timelimit, args.jobs, portfolio, args.beam_width, args.retry,
+            args.metrics, args.profile)
@@ -0,0 +1,73 @@
+import os
+import shutil
+import hashlib
+import threading
+
+# Problem specs and snapshots are kept once each in blob_dir, named by the
+# sha1 of their contents (which is how the server computes problem_spec_hash).
+# problems/<id> and snapshot files are hard links to them, so everything that
+# reads those files works unchanged, and identical problems share one copy.
+blob_dir = "blobs"
+
+def blob_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+def blob_path(h):
+    return os.path.join(blob_dir, h)
+
+def has(h):
+    return os.path.isfile(blob_path(h))
+
+def _tmp(path):
+    d, name = os.path.split(path)
+    return os.path.join(d, "." + name + "." + str(os.getpid()) + "." + str(threading.get_ident()))
+
+# Stores data (bytes) if it isn't already stored, and returns its hash
+def put(data):
+    h = blob_hash(data)
+    path = blob_path(h)
+    if not os.path.isfile(path):
+        os.makedirs(blob_dir, exist_ok = True)
+        tmp = _tmp(path)
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return h
+
+# Makes path a link to blob h, replacing whatever was there. Copies instead
+# if the file system can't link.
+def link(h, path):
+    tmp = _tmp(path)
+    try:
+        os.link(blob_path(h), tmp)
+    except OSError:
+        shutil.copyfile(blob_path(h), tmp)
+    os.replace(tmp, path)
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return blob_hash(f.read())
+
+# Moves every problem in dirname into the store, leaving a link behind.
+# Returns the number of bytes no longer stored twice.
+def dedup(dirname = "problems"):
+    saved = 0
+    for name in os.listdir(dirname):
+        path = os.path.join(dirname, name)
+        if name.startswith(".") or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        h = blob_hash(data)
+        if has(h):
+            if os.path.samefile(blob_path(h), path):
+                continue
+            saved += len(data)
+        else:
+            put(data)
+        link(h, path)
+    return saved
+
+if __name__ == "__main__":
+    saved = dedup()
+    print ("Saved " + str(saved) + " bytes")
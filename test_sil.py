@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+import sil
+
+problems_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "problems")
+
+# Intersects every pair of edges
+def brute_force_split_points(edges):
+    expected = []
+    for e1 in edges:
+        xys = set(e1)
+        for e2 in edges:
+            xy = sil._intersection(e1[0], e1[1], e2[0], e2[1])
+            if xy is not None:
+                xys.add(xy)
+        expected.append(xys)
+    return expected
+
+@pytest.mark.parametrize("pid", [1, 10, 100, 1000, 4043, 1019, 1247, 5903])
+def test_split_points(pid):
+    edges = sil._read(os.path.join(problems_dir, str(pid)))[1]
+    assert sil._split_points(edges) == brute_force_split_points(edges)
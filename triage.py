@@ -0,0 +1,104 @@
+import os
+import math
+import argparse
+
+import sil
+import corpus
+
+# Cheap features of a problem's skeleton, used to reject problems that can't
+# be solved and to run the rest cheapest first. Features are remembered in
+# sil.cache_dir, keyed by the sha1 of the problem file.
+memo_name = "triage"
+
+# Weights of the cost model: the cost grows with the number of facets, falls
+# with the area they cover and grows exponentially with the fraction of
+# facet edges of irrational length, along which no facet can be placed
+# first. Fitted by ranking the solved problems against failed/ (the
+# denominators' sizes made the ranking worse, so they are left out).
+area_weight = 0.5
+irrational_weight = 2
+
+# The number of interior facets, their edges (an edge between two counts
+# twice), how many of those edges have rational length and their total
+# length, and the area of the silhouette
+def features(problem):
+    s = problem.skeleton
+    edges = 0
+    rational = 0
+    length = 0
+    for facet in s.facets:
+        for point, i in facet.points:
+            e = point.edges[i][0]
+            edges += 1
+            if e.rational:
+                rational += 1
+                length += e.length
+    return {"facets" : len(s.facets), "edges" : edges, "rational" : rational,
+            "rational_length" : float(length), "area" : float(s.total_size),
+            "too_big" : bool(s.total_size > 1)}
+
+# Why the problem can't be solved, or None if that isn't known. Searches
+# start by laying a facet along a rational edge, and the folded square has
+# area at most 1.
+def infeasible(f):
+    if f["facets"] == 0:
+        return "the skeleton has no interior facets"
+    if f["rational"] == 0:
+        return "no edge of an interior facet has rational length"
+    if f["too_big"]:
+        return "the silhouette has area more than 1"
+    return None
+
+# Predicted cost of solving, in arbitrary units
+def cost(f):
+    irrational = 1 - f["rational"] / max(1, f["edges"])
+    return (f["facets"] / max(f["area"], 1e-12) ** area_weight *
+            math.exp(irrational_weight * irrational))
+
+# Returns a dict from each pid to its features, loading only problems not
+# seen before
+def estimates(pids, dirname = "problems"):
+    index = corpus.load(dirname)
+    memo = {}
+    path = None
+    if sil.cache_dir is not None:
+        path = os.path.join(sil.cache_dir, memo_name)
+        memo = sil.read_marshal(path, {})
+
+    res = {}
+    changed = False
+    for pid in pids:
+        h = index[pid]["hash"]
+        if h not in memo:
+            memo[h] = features(sil.Problem.fromfile(os.path.join(dirname, str(pid))))
+            changed = True
+        res[pid] = memo[h]
+
+    if changed and path is not None:
+        sil.write_marshal(path, memo)
+    return res
+
+# Splits pids into those worth trying, cheapest first, and a dict from the
+# others to why they can't be solved
+def triage(pids, dirname = "problems"):
+    fs = estimates(pids, dirname)
+    rejected = {}
+    for pid in pids:
+        reason = infeasible(fs[pid])
+        if reason is not None:
+            rejected[pid] = reason
+    order = sorted((pid for pid in pids if pid not in rejected), key = lambda pid : cost(fs[pid]))
+    return order, rejected
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pids", type = int, nargs = "*", help = "default every problem")
+    args = parser.parse_args()
+
+    pids = args.pids or sorted(corpus.load())
+    order, rejected = triage(pids)
+    fs = estimates(order)
+    for pid in order:
+        print (str(pid) + " " + str(round(cost(fs[pid]), 2)))
+    for pid, reason in sorted(rejected.items()):
+        print (str(pid) + " infeasible: " + reason)
@@ -0,0 +1,275 @@
+import os
+import argparse
+import functools
+import multiprocessing
+
+import numpy
+
+import sil
+import solve
+
+# Pixels along each side of the grids used by the fast mode
+resolution = 256
+
+# Fraction of the unit square that may be misclassified by the fast mode's
+# tiling check before the solution is called invalid
+raster_tolerance = 1e-3
+
+def signed_area(points):
+    a = 0
+    n = len(points)
+    for i in range(n):
+        p = points[i]
+        q = points[(i + 1) % n]
+        a += p[0] * q[1] - p[1] * q[0]
+    return a / 2
+
+# Cuts the plane into vertical slabs at every x where a vertex lies or two
+# edges cross. Inside a slab no edges cross, so the region between two edges
+# next to each other is a trapezoid. Yields (area, nonzero, total) for each
+# trapezoid, where for each group nonzero counts the polygons in that group
+# which wind around the trapezoid and total is the sum of their winding
+# numbers. groups[k] is the group of polygons[k]. All exact.
+def _trapezoids(polygons, groups):
+    ngroups = max(groups) + 1
+    edges = []
+    for k, polygon in enumerate(polygons):
+        n = len(polygon)
+        for i in range(n):
+            edges.append((polygon[i], polygon[(i + 1) % n], k))
+
+    xs = set()
+    for xys in sil._split_points([(a, b) for a, b, _ in edges]):
+        for x, _ in xys:
+            xs.add(x)
+    xs = sorted(xs)
+
+    # Non-vertical edges, left end first, with +1 if they run left to right
+    sweep = []
+    for a, b, k in edges:
+        if a[0] < b[0]:
+            sweep.append((a, b, k, 1))
+        elif a[0] > b[0]:
+            sweep.append((b, a, k, -1))
+    sweep.sort(key = lambda e : e[0][0])
+
+    active = []
+    added = 0
+    for x0, x1 in zip(xs, xs[1:]):
+        active = [e for e in active if e[1][0] > x0]
+        while added < len(sweep) and sweep[added][0][0] <= x0:
+            active.append(sweep[added])
+            added += 1
+
+        crossings = []
+        for a, b, k, d in active:
+            slope = (b[1] - a[1]) / (b[0] - a[0])
+            y0 = a[1] + slope * (x0 - a[0])
+            y1 = a[1] + slope * (x1 - a[0])
+            crossings.append((y0 + y1, y0, y1, k, d))
+        crossings.sort(key = lambda c : c[0])
+
+        windings = [0] * len(polygons)
+        nonzero = [0] * ngroups
+        total = [0] * ngroups
+        for i in range(len(crossings) - 1):
+            _, y0, y1, k, d = crossings[i]
+            g = groups[k]
+            if windings[k] == 0:
+                nonzero[g] += 1
+            windings[k] += d
+            if windings[k] == 0:
+                nonzero[g] -= 1
+            total[g] += d
+
+            _, y0_, y1_, _, _ = crossings[i + 1]
+            area = (x1 - x0) * ((y0_ - y0) + (y1_ - y1)) / 2
+            if area > 0:
+                yield area, nonzero, total
+
+# Returns the rigid motion taking the source points of a facet to their
+# destinations, as a function, or raises ValueError if there is none
+def _facet_motion(src, dst):
+    sx, sy = src[0]
+    dx, dy = dst[0]
+    ux, uy = src[1][0] - sx, src[1][1] - sy
+    vx, vy = dst[1][0] - dx, dst[1][1] - dy
+    l2 = ux * ux + uy * uy
+    if vx * vx + vy * vy != l2:
+        raise ValueError("Facet edge changes length when folded")
+
+    for flip in (1, -1):
+        # Rotation taking (ux, flip * uy) to (vx, vy)
+        cos = (ux * vx + flip * uy * vy) / l2
+        sin = (ux * vy - flip * uy * vx) / l2
+        def motion(p, cos = cos, sin = sin, flip = flip):
+            x = p[0] - sx
+            y = flip * (p[1] - sy)
+            return (dx + cos * x - sin * y, dy + sin * x + cos * y)
+        if all(motion(p) == q for p, q in zip(src, dst)):
+            return motion
+    raise ValueError("Facet is not moved rigidly")
+
+# Checks the parts of a solution and returns the destination facets; raises
+# ValueError if the contest would reject it. Each source facet must lie in the
+# unit square and the facets must cover it exactly once.
+def check(sources, facets, dests):
+    for x, y in sources:
+        if x < 0 or x > 1 or y < 0 or y > 1:
+            raise ValueError("Source point outside the unit square")
+    if len(set(sources)) != len(sources):
+        raise ValueError("Repeated source point")
+
+    src_facets = [[sources[i] for i in f] for f in facets]
+    for f in src_facets:
+        if signed_area(f) == 0:
+            raise ValueError("Facet has no area")
+
+    covered = 0
+    for area, nonzero, _ in _trapezoids(src_facets, [0] * len(src_facets)):
+        if nonzero[0] > 1:
+            raise ValueError("Facets overlap")
+        covered += area * nonzero[0]
+    if covered != 1:
+        raise ValueError("Facets cover " + str(covered) + " of the unit square")
+
+    for f in facets:
+        _facet_motion([sources[i] for i in f], [dests[i] for i in f])
+    return [[dests[i] for i in f] for f in facets]
+
+# Area of the silhouette and folded shape in common, divided by the area of
+# their union, exactly. The silhouette's holes wind clockwise.
+def resemblance(problem, dst_facets):
+    polygons = problem.polygons + dst_facets
+    groups = [0] * len(problem.polygons) + [1] * len(dst_facets)
+    inter = 0
+    union = 0
+    for area, nonzero, total in _trapezoids(polygons, groups):
+        inside = total[0] > 0
+        folded = nonzero[1] > 0
+        if inside and folded:
+            inter += area
+        if inside or folded:
+            union += area
+    return inter / union
+
+# Winding number of polygon, as floats, around the centres of an n by n grid
+# of pixels over box = ((x0, x1), (y0, y1))
+def raster(polygon, box, n):
+    (x0, x1), (y0, y1) = box
+    w = (x1 - x0) / n
+    h = (y1 - y0) / n
+    rows = y0 + (numpy.arange(n) + 0.5) * h
+    acc = numpy.zeros((n, n + 1), dtype = numpy.int32)
+    m = len(polygon)
+    for i in range(m):
+        ax, ay = polygon[i]
+        bx, by = polygon[(i + 1) % m]
+        if ay == by:
+            continue
+        # Moving right across an edge going up leaves an anticlockwise polygon
+        d = -1 if ay < by else 1
+        r = numpy.nonzero((rows >= min(ay, by)) & (rows < max(ay, by)))[0]
+        x = ax + (rows[r] - ay) * (bx - ax) / (by - ay)
+        c = numpy.clip(numpy.ceil((x - x0) / w - 0.5), 0, n).astype(numpy.int64)
+        acc[r, c] += d
+    return numpy.cumsum(acc[:, :n], axis = 1)
+
+# Converts to floats after moving origin to (0, 0) exactly, so that far away
+# shapes keep their precision
+def _float_polygon(polygon, origin = (0, 0)):
+    return [(float(x - origin[0]), float(y - origin[1])) for x, y in polygon]
+
+# Fast mode: as check and resemblance, but covering the unit square and
+# comparing shapes on n by n pixel grids in floating point
+def check_raster(sources, facets, dests, n = resolution):
+    for x, y in sources:
+        if x < 0 or x > 1 or y < 0 or y > 1:
+            raise ValueError("Source point outside the unit square")
+    if len(set(sources)) != len(sources):
+        raise ValueError("Repeated source point")
+    count = numpy.zeros((n, n), dtype = numpy.int32)
+    for f in facets:
+        count += raster(_float_polygon([sources[i] for i in f]), ((0, 1), (0, 1)), n) != 0
+    bad = numpy.count_nonzero(count != 1) / (n * n)
+    if bad > raster_tolerance:
+        raise ValueError("Facets overlap or leave gaps over " + str(bad) + " of the unit square")
+    for f in facets:
+        _facet_motion([sources[i] for i in f], [dests[i] for i in f])
+    return [[dests[i] for i in f] for f in facets]
+
+def resemblance_raster(problem, dst_facets, n = resolution):
+    origin = (min(x for p in problem.polygons for x, _ in p), min(y for p in problem.polygons for _, y in p))
+    polygons = [_float_polygon(p, origin) for p in problem.polygons]
+    folded = [_float_polygon(f, origin) for f in dst_facets]
+    xs = [x for p in polygons + folded for x, _ in p]
+    ys = [y for p in polygons + folded for _, y in p]
+    box = ((min(xs), max(xs)), (min(ys), max(ys)))
+
+    inside = numpy.zeros((n, n), dtype = numpy.int32)
+    for p in polygons:
+        inside += raster(p, box, n)
+    covered = numpy.zeros((n, n), dtype = bool)
+    for f in folded:
+        covered |= raster(f, box, n) != 0
+    inside = inside > 0
+    return numpy.count_nonzero(inside & covered) / max(1, numpy.count_nonzero(inside | covered))
+
+# Returns a dict saying whether solutions/<pid> is valid and, if so, its
+# resemblance to problems/<pid>. A file over the contest's size limit is
+# invalid.
+def validate(pid, fast = False, n = resolution):
+    result = {"pid" : pid, "valid" : False, "error" : None, "resemblance" : 0}
+    try:
+        with open("solutions/" + str(pid)) as f:
+            text = f.read()
+        solve.check_size(len("".join(text.split())))
+        sources, facets, dests = sil.parse_solution(text)
+        problem = sil.Problem.read_by_pid(pid)
+        if fast:
+            dst_facets = check_raster(sources, facets, dests, n)
+            result["resemblance"] = resemblance_raster(problem, dst_facets, n)
+        else:
+            dst_facets = check(sources, facets, dests)
+            result["resemblance"] = float(resemblance(problem, dst_facets))
+            result["perfect"] = result["resemblance"] == 1
+    except ValueError as e:
+        result["error"] = str(e)
+    else:
+        result["valid"] = True
+    return result
+
+def solution_pids():
+    return sorted(int(x) for x in os.listdir("solutions") if x.isdigit())
+
+# Validates the solutions in parallel, printing each result as it arrives in
+# pid order, and returns the results
+def validate_all(pids, jobs = None, fast = False, n = resolution):
+    results = []
+    with multiprocessing.Pool(jobs) as pool:
+        for r in pool.imap(functools.partial(validate, fast = fast, n = n), pids):
+            if r["valid"]:
+                print ("Problem " + str(r["pid"]) + ": resemblance " + str(r["resemblance"]))
+            else:
+                print ("Problem " + str(r["pid"]) + ": INVALID " + r["error"])
+            results.append(r)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pids", type = int, nargs = "*", help = "default all of solutions/")
+    parser.add_argument("-j", "--jobs", type = int, default = None)
+    parser.add_argument("--fast", action = "store_true",
+            help = "rasterise instead of clipping exactly")
+    parser.add_argument("-n", "--resolution", type = int, default = resolution,
+            help = "pixels along each side in fast mode")
+    args = parser.parse_args()
+
+    pids = args.pids or solution_pids()
+    results = validate_all(pids, args.jobs, args.fast, args.resolution)
+    invalid = [r["pid"] for r in results if not r["valid"]]
+    imperfect = [r["pid"] for r in results if r["valid"] and r["resemblance"] < 1]
+    print (str(len(results)) + " solutions, " + str(len(invalid)) + " invalid, " +
+            str(len(imperfect)) + " not perfect")
+    if len(invalid) > 0:
+        print ("Invalid: " + " ".join(str(pid) for pid in invalid))
@@ -5,48 +5,126 @@ import requests
 import json
 import os
 import os.path
+import threading
+import concurrent.futures
+import requests.adapters
+
+import store
+import solve
+import validate
 
 teamid = 248
 
-url_hello = "http://2016sv.icfpcontest.org/api/hello"
-url_blob = "http://2016sv.icfpcontest.org/api/blob/" # apppend the hash
-url_snapshot_list = "http://2016sv.icfpcontest.org/api/snapshot/list"
-url_submit_problem = "http://2016sv.icfpcontest.org/api/problem/submit" # POST
-url_submit_solution = "http://2016sv.icfpcontest.org/api/solution/submit" # POST
+# Base of the contest API; point it at a mock_api.py server to try things out
+api = "http://2016sv.icfpcontest.org/api"
 
-def get(url, post = None, filename = None):
-    time.sleep(1.001) # minimum 1 second between queries
-    apikeyheader = "X-API-Key"
-    apikey = "248-b09bb7ee975fa210cd17aa20ad96bccc"
+def url(path):
+    return api + "/" + path
 
-    headers = {
-            apikeyheader : apikey,
-            "Accept-Encoding" : "gzip"
-            }
+apikeyheader = "X-API-Key"
+apikey = "248-b09bb7ee975fa210cd17aa20ad96bccc"
 
-    if post is None:
-        r = requests.get(url, headers = headers)
-    else:
-        r = requests.post(url, headers = headers, data = post, files = {'solution_spec' : open(filename, 'rb')})
+# The server allows one request a second; we leave a little slack for jitter.
+# Requests are spaced by a token bucket shared by all threads, so time spent
+# waiting for a response isn't lost from the budget.
+rate = 1 / 1.02
+burst = 1
 
-    print (url + ' ' + str(r.status_code))
-    try:
-        r.raise_for_status()
-    except:
-        print (r.text)
-        raise
-    return r
+# Threads working through the queue at once
+workers = 4
+
+# Failed requests (no connection, 429 or 5xx) are tried again up to retries
+# times, waiting backoff, then twice that, and so on
+retries = 5
+backoff = 2
+timeout = 60
+
+# Jobs not yet done, one file each, so an interrupted run can be resumed
+queue_dir = "queue"
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Takes a token, waiting until one is due. Tokens may be taken in
+    # advance, so callers are served in the order they arrive.
+    def take(self):
+        with self.lock:
+            t = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (t - self.last) * self.rate)
+            self.last = t
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+bucket = TokenBucket(rate, burst)
+
+_session = None
+_session_lock = threading.Lock()
+
+# One keep-alive connection pool for everything
+def session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = workers)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.headers.update({
+                    apikeyheader : apikey,
+                    "Accept-Encoding" : "gzip"
+                    })
+            _session = s
+        return _session
+
+def get(url, post = None, filename = None):
+    for attempt in range(retries + 1):
+        bucket.take()
+        try:
+            if post is None:
+                r = session().get(url, timeout = timeout)
+            else:
+                with open(filename, 'rb') as f:
+                    r = session().post(url, data = post, files = {'solution_spec' : f}, timeout = timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            print (url + ' ' + str(e))
+            error = e
+            delay = backoff * 2 ** attempt
+        else:
+            print (url + ' ' + str(r.status_code))
+            if r.status_code != 429 and r.status_code < 500:
+                try:
+                    r.raise_for_status()
+                except:
+                    print (r.text)
+                    raise
+                return r
+            error = requests.HTTPError(str(r.status_code) + " " + r.reason, response = r)
+            delay = backoff * 2 ** attempt
+            if r.headers.get("Retry-After", "").isdigit():
+                delay = max(delay, int(r.headers["Retry-After"]))
+        if attempt < retries:
+            time.sleep(delay)
+    raise error
 
+# Blobs go in the store, and filename becomes a link to the stored copy
 def saveblob(blobhash, filename):
-    blob = get(url_blob + blobhash).text
-    with open(filename, 'w') as f:
-        f.write(blob)
+    h = store.put(get(url("blob/" + blobhash)).content)
+    if h != blobhash:
+        print ("Blob " + blobhash + " has hash " + h)
+    store.link(h, filename)
 
 def hello():
-    print (get(url_hello).json())
+    print (get(url("hello")).json())
 
 def save_most_recent_snapshot(filename = "snapshot"):
-    snapshots = get(url_snapshot_list).json()["snapshots"]
+    snapshots = get(url("snapshot/list")).json()["snapshots"]
 
     h = None
     lasttime = None
@@ -57,6 +135,65 @@ def save_most_recent_snapshot(filename = "snapshot"):
 
     saveblob(h, filename)
 
+# Adds a job to the queue. Jobs are named after what they do, so queueing
+# the same thing twice only does it once.
+def enqueue(kind, *args):
+    os.makedirs(queue_dir, exist_ok = True)
+    name = "-".join([kind] + [str(a).replace("/", "_") for a in args])
+    path = os.path.join(queue_dir, name)
+    if not os.path.isfile(path):
+        solve.write_atomic(path, json.dumps({"kind" : kind, "args" : args}))
+
+def queued_jobs():
+    if not os.path.isdir(queue_dir):
+        return []
+    names = [x for x in os.listdir(queue_dir) if not x.startswith(".")]
+    paths = [os.path.join(queue_dir, x) for x in names]
+    paths = [p for p in paths if os.path.isfile(p)]
+    return sorted(paths, key = lambda p : (os.path.getmtime(p), p))
+
+# Whether a job that raised e may work if tried again later: the server
+# couldn't be reached, or was busy or broken. Any other error, from the server
+# or from the job itself, will happen again.
+def transient(e):
+    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return False
+
+# Jobs that can't succeed are moved here, out of the queue, to be looked at
+def dead_dir():
+    return os.path.join(queue_dir, "dead")
+
+def run_job(path):
+    try:
+        with open(path) as f:
+            job = json.load(f)
+        jobs[job["kind"]](*job["args"])
+    except Exception as e:
+        print ("Job " + os.path.basename(path) + " failed: " + str(e))
+        if not transient(e):
+            os.makedirs(dead_dir(), exist_ok = True)
+            os.replace(path, os.path.join(dead_dir(), os.path.basename(path)))
+        return False
+    os.remove(path)
+    return True
+
+# Does every queued job, including any left over from an interrupted run.
+# Jobs that fail for a reason that may pass stay queued for next time; the
+# others are moved to dead_dir(). Returns the number that failed.
+def run_queue():
+    paths = queued_jobs()
+    if len(paths) == 0:
+        return 0
+    print ("Running " + str(len(paths)) + " queued jobs")
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        done = list(pool.map(run_job, paths))
+    return done.count(False)
+
+# Queues every problem in the snapshot that isn't in problems/ yet, then
+# downloads them. Problems whose spec is already stored aren't downloaded.
 def download_problems(snapshot_file = "snapshot"):
     with open(snapshot_file) as f:
         snapshot = json.load(f)
@@ -66,27 +203,24 @@ def download_problems(snapshot_file = "snapshot"):
     print ("Iterating over problems")
     print ("Number of problems: " + str(len(problems)))
 
-    i = 0
     for p in problems:
-
         path = "problems/" + str(p["problem_id"])
         if os.path.isfile(path):
             continue
         if os.path.exists(path):
             raise ValueError("Path " + path + " exists but is not a file")
+        if store.has(p["problem_spec_hash"]):
+            store.link(p["problem_spec_hash"], path)
+        else:
+            enqueue("blob", p["problem_spec_hash"], path)
 
-        i = i + 1
-        if i > 1000:
-            print ("Too many requests, did 1000 of " + str(len(problems)) + ".")
-            return
+    failed = run_queue()
+    if failed > 0:
+        print (str(failed) + " downloads failed; run again to retry them.")
 
-        try:
-            saveblob(p["problem_spec_hash"], path)
-        except:
-            print ("Failed to write to " + path + ".")
-            os.remove(path)
-        else:
-            print ("Saved to " + path + " .")
+def publish_at(filename, t):
+    r = get(url("problem/submit"), {'publish_time' : str(t)}, filename)
+    print (r.text)
 
 # valid values for hour is 0 through 45 inclusive, or None to mean all the remaining ones
 def publish_problem(filename, hour = None):
@@ -107,8 +241,8 @@ def publish_problem(filename, hour = None):
         if t1 <= t2:
             print ("You missed your chance for hour " + str(h) + "!")
         else:
-            r = get(url_submit_problem, {'publish_time' : str(t)}, filename)
-            print (r.text)
+            enqueue("publish", filename, t)
+    run_queue()
 
 def unsubmitted_solutions():
     xs = os.listdir("solutions")
@@ -116,22 +250,37 @@ def unsubmitted_solutions():
 
     res = []
     for x in xs:
-        if x not in ys:
+        if x not in ys and x.isdigit():
             res.append(int(x))
     return sorted(res)
 
 def submit_solution(pid):
     print("Submitting", pid)
-    r = get(url_submit_solution, {'problem_id' : str(pid)}, "solutions/" + str(pid))
+    r = get(url("solution/submit"), {'problem_id' : str(pid)}, "solutions/" + str(pid))
     print (r.text)
     open("submitted/" + str(pid), 'a').close()
 
-def submit_solutions():
+# With check, solutions that fail validate.validate are not uploaded
+def submit_solutions(check = True):
     for pid in unsubmitted_solutions():
-        submit_solution(pid)
+        if check:
+            r = validate.validate(pid)
+            if not r["valid"]:
+                print ("Not submitting " + str(pid) + ": " + r["error"])
+                continue
+        enqueue("submit", pid)
+    run_queue()
+
+# What each kind of queued job does
+jobs = {
+        "blob" : saveblob,
+        "publish" : publish_at,
+        "submit" : submit_solution
+        }
 
 if __name__ == "__main__":
     # publish_problem('myproblems/example')
     # save_most_recent_snapshot()
     # download_problems()
+    run_queue()
     submit_solutions()